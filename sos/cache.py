@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Cache module, on-disk caches for SOS replies
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import xml.etree.cElementTree as ElementTree
+
+__all__ = ['FileCache', 'CapabilitiesCache', 'ObservationsCache']
+
+class FileCache (object):
+    """
+    Files stored in a directory by key. Metadata of every entry (size, last
+    use and any value given to put) is kept in an index file.
+    Least recently used entries are evicted when total size exceeds maxSize.
+    """
+    indexName = "index.json"
+
+    def __init__(self, directory, maxSize = 50 * 1024 * 1024):
+        """
+        :param directory: Cache directory, created if it doesn't exist
+        :type directory: str
+        :param maxSize: Maximum size in bytes of cached files
+        :type maxSize: int
+        """
+        self.directory = directory
+        self.maxSize = maxSize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            with open (os.path.join(directory, self.indexName)) as index:
+                self._index = json.load(index)
+        except (IOError, ValueError):
+            self._index = {}
+        #Descartar entradas cuyo fichero ya no existe
+        for key in self._index.keys():
+            if not os.path.exists(self.fileName(key)):
+                del self._index[key]
+
+    def __contains__ (self, key):
+        return key in self._index
+
+    def __len__ (self):
+        return len(self._index)
+
+    @property
+    def size (self):
+        """
+        Total size in bytes of cached files
+        """
+        return sum(entry['size'] for entry in self._index.values())
+
+    def fileName (self, key):
+        """
+        :return: Path of the cached file for key, it may not exist
+        """
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8") if isinstance(key, unicode) else key).hexdigest())
+
+    def get (self, key):
+        """
+        :return: Metadata stored with key, None if not cached. Entry is marked as used
+        :rtype: dict
+        """
+        entry = self._index.get(key)
+        if entry:
+            entry['used'] = time.time()
+            self._save()
+        return entry
+
+    def put (self, key, fileName, **metadata):
+        """
+        Copy fileName to cache
+        :param key: Cache key
+        :type key: str
+        :param fileName: File to store
+        :type fileName: str
+        :param metadata: Values stored with the entry, must be JSON serializable
+        """
+        shutil.copyfile (fileName, self.fileName(key))
+        entry = dict(metadata)
+        entry['size'] = os.path.getsize(self.fileName(key))
+        entry['stored'] = entry['used'] = time.time()
+        self._index[key] = entry
+        self._evict(key)
+        self._save()
+
+    def remove (self, key):
+        if self._index.pop(key, None) != None:
+            self._removeFiles(key)
+            self._save()
+
+    def clear (self):
+        for key in self._index.keys():
+            self.remove(key)
+
+    def _evict (self, keep = None):
+        size = self.size
+        for key in sorted(self._index, key = lambda k: self._index[k]['used']):
+            if size <= self.maxSize:
+                break
+            if key != keep:
+                size -= self._index[key]['size']
+                del self._index[key]
+                self._removeFiles(key)
+
+    def _removeFiles (self, key):
+        try:
+            os.remove(self.fileName(key))
+        except OSError:
+            pass
+
+    def _save (self):
+        with open (os.path.join(self.directory, self.indexName), "w") as index:
+            json.dump(self._index, index)
+
+class CapabilitiesCache (FileCache):
+    """
+    GetCapabilities replies by URL. Entries younger than ttl are used without
+    request, older ones are revalidated with a conditional GET using the
+    ETag and Last-Modified headers of the stored reply.
+    """
+    def __init__(self, directory, maxSize = 50 * 1024 * 1024, ttl = 3600):
+        """
+        :param ttl: Seconds a reply is used without revalidation
+        :type ttl: int
+        """
+        super (CapabilitiesCache, self).__init__(directory, maxSize)
+        self.ttl = ttl
+
+    def fresh (self, url):
+        """
+        :return: True if the reply for url can be used without revalidation
+        """
+        entry = self._index.get(url)
+        return entry != None and time.time() - entry['stored'] < self.ttl
+
+    def validators (self, url):
+        """
+        :return: Conditional request headers for url
+        :rtype: dict
+        """
+        entry = self._index.get(url)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('lastModified'):
+            headers['If-Modified-Since'] = entry['lastModified']
+        return headers
+
+    def snapshotFileName (self, url):
+        """
+        :return: Path of the parsed capabilities snapshot for url, see SensorObservationService
+        """
+        return self.fileName(url) + ".snapshot"
+
+    def revalidated (self, url):
+        """
+        Server replied 304 Not Modified, the stored reply is fresh again
+        """
+        entry = self.get(url)
+        if entry:
+            entry['stored'] = time.time()
+            self._save()
+
+    def _removeFiles (self, key):
+        super (CapabilitiesCache, self)._removeFiles(key)
+        try:
+            os.remove(self.snapshotFileName(key))
+        except OSError:
+            pass
+
+class ObservationsCache (FileCache):
+    """
+    GetObservation replies by request. Keys are built from the canonical form
+    of the posted XML, so requests differing only in namespace prefixes,
+    attribute order or whitespace share the entry. Entries older than ttl
+    are discarded, as requests of latest observations change with time.
+    """
+    def __init__(self, directory, maxSize = 200 * 1024 * 1024, ttl = 86400):
+        """
+        :param ttl: Seconds a reply is used
+        :type ttl: int
+        """
+        super (ObservationsCache, self).__init__(directory, maxSize)
+        self.ttl = ttl
+
+    @staticmethod
+    def canonical (xml):
+        """
+        :param xml: GetObservation request
+        :type xml: str
+        :return: Request with sorted attributes and without whitespace
+        between elements, serialized by ElementTree so names and values are
+        escaped. Namespace prefixes are given by ElementTree in document
+        order. Whitespace collapsed if it isn't valid XML
+        :rtype: str
+        """
+        if isinstance(xml, unicode):
+            xml = xml.encode("utf-8")
+        try:
+            root = ElementTree.fromstring(xml)
+        except SyntaxError:
+            return " ".join(xml.split())
+
+        for node in root.iter():
+            attributes = sorted(node.items())
+            node.attrib.clear()
+            for name, value in attributes:
+                node.set(name, value)
+            node.text = (node.text or "").strip() or None
+            node.tail = (node.tail or "").strip() or None
+        return ElementTree.tostring(root, encoding="utf-8")
+
+    def key (self, url, post):
+        """
+        :param url: GetObservation URL
+        :type url: unicode
+        :param post: GetObservation request
+        :type post: str
+        :return: Cache key of the request
+        :rtype: str
+        """
+        return hashlib.sha1(url.encode("utf-8") + "\n" + self.canonical(post)).hexdigest()
+
+    def fresh (self, key):
+        """
+        :return: True if a reply for key is cached and younger than ttl.
+        Older replies are removed
+        """
+        entry = self._index.get(key)
+        if entry != None and time.time() - entry['stored'] >= self.ttl:
+            self.remove(key)
+            entry = None
+        return entry != None
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Network module, concurrent requests through QgsNetworkAccessManager
+"""
+from PyQt4.QtCore import QObject, QTimer, pyqtSignal
+from PyQt4.QtNetwork import QNetworkRequest, QNetworkReply
+from qgis.core import QgsNetworkAccessManager
+from collections import deque
+import os
+import re
+import json
+import zlib
+import hashlib
+
+__all__ = ['RequestQueue', 'ReplyDecoder', 'DownloadManifest', 'ReplyFile', 'setRequestHeaders']
+
+def _requestHash (*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8") if isinstance(part, unicode) else part or "")
+    return digest.hexdigest()
+
+def setRequestHeaders (request, headers = {}):
+    """
+    Set raw headers and ask for compressed and persistent connections.
+    All requests share QgsNetworkAccessManager, which keeps connections
+    open by host, so capabilities and observations requests reuse them.
+    :param request: Request
+    :type request: QNetworkRequest
+    :param headers: Raw headers
+    :type headers: dict
+    """
+    request.setRawHeader("Accept-Encoding", ReplyDecoder.acceptEncoding)
+    request.setRawHeader("Connection", "keep-alive")
+    for header, value in headers.items():
+        request.setRawHeader(str(header), str(value))
+
+class ReplyDecoder (object):
+    """
+    Decode gzip or deflate Content-Encoding of a reply while it's read.
+    Qt only decompresses gzip when Accept-Encoding isn't set by the
+    request, and then the compressed size is unknown, so it's done here.
+    """
+    acceptEncoding = "gzip, deflate"
+
+    def __init__(self, reply):
+        """
+        :param reply: Reply of a request with Accept-Encoding set by setRequestHeaders
+        :type reply: QNetworkReply
+        """
+        self._reply = reply
+        self._encoding = None
+        self._decompress = None
+        self.wireBytes = 0
+        self.decodedBytes = 0
+        self.error = ""
+
+    def read (self):
+        """
+        :return: Decoded data available at reply
+        :rtype: str
+        """
+        return self.decode(self._reply.readAll().data())
+
+    def decode (self, data):
+        """
+        :param data: Data as received
+        :type data: str
+        :return: Decoded data, empty after a decoding error
+        :rtype: str
+        """
+        if self.error:
+            return ""
+        if self._encoding == None:
+            self._encoding = str(self._reply.rawHeader("Content-Encoding")).strip().lower()
+            if self._encoding in ["gzip", "x-gzip"]:
+                self._decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif self._encoding == "deflate":
+                self._decompress = zlib.decompressobj()
+        first = self.wireBytes == 0
+        self.wireBytes += len(data)
+        try:
+            if self._decompress:
+                try:
+                    data = self._decompress.decompress(data)
+                except zlib.error:
+                    #Algunos servidores envían deflate sin cabecera zlib
+                    if self._encoding != "deflate" or not first:
+                        raise
+                    self._decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+                    data = self._decompress.decompress(data)
+        except zlib.error as error:
+            self.error = "{} content: {}".format(self._encoding, error)
+            return ""
+        self.decodedBytes += len(data)
+        return data
+
+    def flush (self):
+        """
+        :return: Decoded data left when reply is finished
+        :rtype: str
+        """
+        data = self._decompress.flush() if self._decompress and not self.error else ""
+        self.decodedBytes += len(data)
+        return data
+
+class RequestQueue (QObject):
+    """
+    Run requests through QgsNetworkAccessManager, at most maxInFlight at a
+    time. Requests are identified in signals by the key given to add.
+    Failed requests are sent again up to retries times, waiting backoff
+    seconds doubled on each attempt. requestRetried is emitted before, data
+    already received from that request must be discarded.
+    Replies bigger than the request maxSize are aborted and reported by
+    requestTooLarge instead of requestFinished.
+    Replies are decoded by ReplyDecoder, wireBytes and decodedBytes count
+    the size of all replies as received and decoded.
+    """
+    dataReceived = pyqtSignal (object, object)
+    requestRetried = pyqtSignal (object)
+    requestTooLarge = pyqtSignal (object)
+    requestFinished = pyqtSignal (object, unicode)
+    progress = pyqtSignal (int, int)
+    finished = pyqtSignal ()
+
+    #Errores que no se deben a la red o al servidor
+    noRetryErrors = [QNetworkReply.ContentAccessDenied,
+                     QNetworkReply.ContentOperationNotPermittedError,
+                     QNetworkReply.ContentNotFoundError,
+                     QNetworkReply.AuthenticationRequiredError,
+                     QNetworkReply.ProtocolUnknownError,
+                     QNetworkReply.ProtocolInvalidOperationError]
+
+    def __init__(self, maxInFlight = 4, parent = None, retries = 0, backoff = 1.0):
+        """
+        :param maxInFlight: Maximum number of concurrent requests
+        :type maxInFlight: int
+        :param retries: Attempts after a failed request
+        :type retries: int
+        :param backoff: Seconds to wait before first retry
+        :type backoff: float
+        """
+        super (RequestQueue, self).__init__(parent)
+        self.maxInFlight = maxInFlight
+        self.retries = retries
+        self.backoff = backoff
+        self._pending = deque()
+        self._replies = {}
+        self._decoders = {}
+        self._waiting = 0
+        self._aborted = False
+        self._total = 0
+        self._done = 0
+        self.wireBytes = 0
+        self.decodedBytes = 0
+
+    @property
+    def inFlight (self):
+        return len(self._replies)
+
+    def add (self, key, url, post = None, headers = {}, maxSize = 0):
+        """
+        Queue a request, it's sent as soon as there are less than maxInFlight running
+        :param key: Request identifier, any hashable value
+        :param url: Request URL
+        :type url: QUrl
+        :param post: XML to post, GET request if None
+        :type post: str
+        :param headers: Raw request headers
+        :type headers: dict
+        :param maxSize: Maximum reply size in bytes, 0 if unlimited
+        :type maxSize: int
+        """
+        self._pending.append((key, url, post, headers, maxSize, 0))
+        self._total += 1
+        self._next()
+
+    def abort (self):
+        """
+        Discard pending requests and abort running ones
+        """
+        self._aborted = True
+        self._total -= len(self._pending)
+        self._pending.clear()
+        for reply in self._replies.keys():
+            reply.abort()
+
+    def _next (self):
+        while len(self._pending) and len(self._replies) < self.maxInFlight:
+            request = self._pending.popleft()
+            key, url, post, headers, _, _ = request
+            networkRequest = QNetworkRequest(url)
+            setRequestHeaders(networkRequest, headers)
+            if post:
+                networkRequest.setRawHeader('Content-Type', 'application/xml')
+                reply = QgsNetworkAccessManager.instance().post(networkRequest, post)
+            else:
+                reply = QgsNetworkAccessManager.instance().get(networkRequest)
+            self._replies[reply] = request
+            self._decoders[reply] = ReplyDecoder(reply)
+            reply.readyRead.connect(lambda reply = reply: self._readyRead(reply))
+            reply.finished.connect(lambda reply = reply: self._finished(reply))
+
+    def _readyRead (self, reply):
+        key, _, _, _, maxSize, _ = self._replies[reply]
+        decoder = self._decoders[reply]
+        data = decoder.read()
+        if decoder.error or (maxSize and decoder.wireBytes > maxSize):
+            if reply.isRunning():
+                reply.abort()
+            return
+        self.dataReceived.emit(key, data)
+
+    def _finished (self, reply):
+        if reply.bytesAvailable():
+            self._readyRead(reply)
+        decoder = self._decoders.pop(reply)
+        request = self._replies.pop(reply)
+        key, url, post, headers, maxSize, attempt = request
+        if reply.error() == QNetworkReply.NoError:
+            data = decoder.flush()
+            if len(data):
+                self.dataReceived.emit(key, data)
+        error = decoder.error or (reply.errorString() if reply.error() != QNetworkReply.NoError else "")
+        self.wireBytes += decoder.wireBytes
+        self.decodedBytes += decoder.decodedBytes
+        tooLarge = maxSize and decoder.wireBytes > maxSize
+        retry = error and not tooLarge and self._retry(reply) and attempt < self.retries
+        reply.deleteLater()
+
+        if tooLarge:
+            self._done += 1
+            self.requestTooLarge.emit(key)
+            self.progress.emit(self._done, self._total)
+        elif retry:
+            self.requestRetried.emit(key)
+            self._waiting += 1
+            QTimer.singleShot(int(self.backoff * 2 ** attempt * 1000), lambda: self._resend((key, url, post, headers, maxSize, attempt + 1)))
+        else:
+            self._done += 1
+            self.requestFinished.emit(key, error)
+            self.progress.emit(self._done, self._total)
+        self._next()
+        self._checkFinished()
+
+    def _retry (self, reply):
+        if self._aborted or reply.error() in self.noRetryErrors:
+            return False
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        return not status or status >= 500 or status in [408, 429]
+
+    def _resend (self, request):
+        self._waiting -= 1
+        if self._aborted:
+            self._total -= 1
+        else:
+            self._pending.appendleft(request)
+            self._next()
+        self._checkFinished()
+
+    def _checkFinished (self):
+        if not len(self._replies) and not len(self._pending) and not self._waiting:
+            self.finished.emit()
+
+class DownloadManifest (object):
+    """
+    Sidecar file of an interrupted download, kept in the work directory
+    next to the partial reply so the same request can be resumed later.
+    A single reply is resumed with a Range request when the server allows
+    it. Replies of a batch of requests (time windows or spatial tiles) are
+    resumed after the last completed one, see addChunk.
+    """
+    suffix = ".part.json"
+
+    def __init__(self, directory, url, posts = []):
+        """
+        :param directory: Work directory
+        :type directory: str
+        :param url: Request URL
+        :type url: unicode
+        :param posts: XML posted by each request
+        :type posts: str list
+        """
+        self.fileName = os.path.join(directory, "sosclient-" + _requestHash(url, *posts) + self.suffix)
+        try:
+            with open (self.fileName) as manifest:
+                values = json.load(manifest)
+        except (IOError, ValueError):
+            values = {}
+        self.replyFileName = values.get('replyFile', "")
+        self.size = values.get('size', 0)
+        self.etag = values.get('etag', "")
+        self.lastModified = values.get('lastModified', "")
+        self._chunks = values.get('chunks', {})
+
+    @property
+    def resumable (self):
+        """
+        True if the partial reply is still as it was left
+        """
+        return self.size > 0 and os.path.exists(self.replyFileName) and os.path.getsize(self.replyFileName) == self.size
+
+    def rangeHeaders (self):
+        """
+        :return: Request headers to get the rest of the partial reply.
+        Offset is on decoded data, so reply mustn't be compressed
+        :rtype: dict
+        """
+        headers = {'Range': "bytes={}-".format(self.size), 'Accept-Encoding': "identity"}
+        if self.etag or self.lastModified:
+            headers['If-Range'] = self.etag or self.lastModified
+        return headers
+
+    def resumed (self, reply):
+        """
+        :param reply: Reply of a request with rangeHeaders
+        :type reply: QNetworkReply
+        :return: True if reply continues the partial reply, else it's the whole reply
+        """
+        if reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) != 206:
+            return False
+        contentRange = re.match(r"bytes\s+(\d+)-", str(reply.rawHeader("Content-Range")))
+        return contentRange != None and int(contentRange.group(1)) == self.size
+
+    def keep (self, replyFileName, reply):
+        """
+        Save manifest of a failed download
+        :param replyFileName: Partial reply, as decoded
+        :type replyFileName: str
+        :param reply: Failed reply
+        :type reply: QNetworkReply
+        """
+        if not self.resumed(reply):
+            self.etag = str(reply.rawHeader("ETag"))
+            self.lastModified = str(reply.rawHeader("Last-Modified"))
+        self.replyFileName = replyFileName
+        self.size = os.path.getsize(replyFileName)
+        self.save()
+
+    def chunk (self, post):
+        """
+        :param post: XML posted by a request of the batch
+        :type post: str
+        :return: Reply of a completed request, None if it must be requested
+        :rtype: str
+        """
+        fileName = self._chunks.get(_requestHash(post))
+        return fileName if fileName and os.path.exists(fileName) else None
+
+    def addChunk (self, post, fileName):
+        """
+        Request of the batch completed, reply is saved on fileName
+        """
+        self._chunks[_requestHash(post)] = fileName
+
+    def save (self):
+        with open (self.fileName, "w") as manifest:
+            json.dump({'replyFile': self.replyFileName, 'size': self.size, 'etag': self.etag,
+                       'lastModified': self.lastModified, 'chunks': self._chunks}, manifest)
+
+    def remove (self):
+        """
+        Download completed, remove manifest and replies of completed requests
+        """
+        for fileName in self._chunks.values():
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+        self._chunks = {}
+        try:
+            os.remove(self.fileName)
+        except OSError:
+            pass
+
+class ReplyFile (object):
+    """
+    File where a reply is written while it's downloaded. It isn't opened
+    until the reply has data, when it's known if the reply continues the
+    partial reply of the manifest, so a resumed request that fails before
+    any data arrives leaves the partial reply as it was.
+    """
+
+    def __init__(self, fileName, manifest, resume = False):
+        """
+        :param fileName: Reply file, the partial reply if resume
+        :type fileName: str
+        :param manifest: Manifest of the request
+        :type manifest: DownloadManifest
+        :param resume: The request asked for the rest of the partial reply
+        :type resume: bool
+        """
+        self.fileName = fileName
+        self.manifest = manifest
+        self.resume = resume
+        self._file = None
+
+    def open (self, reply):
+        """
+        Open the file, appending to the partial reply if reply continues it,
+        else truncating it
+        :param reply: Reply being downloaded
+        :type reply: QNetworkReply
+        :return: True if the file has been opened now to resume the partial reply
+        :rtype: bool
+        """
+        if self._file:
+            return False
+        resumed = self.resume and self.manifest.resumed(reply)
+        self._file = open (self.fileName, "a" if resumed else "w")
+        return resumed
+
+    def write (self, reply, data):
+        self.open(reply)
+        self._file.write(data)
+
+    def finish (self, reply, failed, resumable = False, keepFile = False):
+        """
+        Close the file and keep the manifest if there's something to resume
+        :param reply: Finished reply
+        :type reply: QNetworkReply
+        :param failed: The request failed
+        :type failed: bool
+        :param resumable: The request failed, but what was downloaded is part of a correct reply
+        :type resumable: bool
+        :param keepFile: Don't remove the file when there's nothing to resume
+        :type keepFile: bool
+        :return: True if the partial reply is kept to resume it
+        :rtype: bool
+        """
+        if self._file:
+            self._file.close()
+        elif failed and self.resume:
+            #Reintento sin datos, la respuesta parcial sigue intacta
+            return True
+        if resumable and os.path.exists(self.fileName) and os.path.getsize(self.fileName):
+            self.manifest.keep(self.fileName, reply)
+            return True
+        self.manifest.remove()
+        if not keepFile and os.path.exists(self.fileName):
+            os.remove(self.fileName)
+        return False
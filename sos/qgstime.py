@@ -4,44 +4,205 @@
 """
 
 import abc
+import re
+import calendar
+import functools
 from dateutil import parser as DateTimeParser
-from datetime import datetime
-#import pytz
+from dateutil.tz import tzutc, tzoffset
+from datetime import datetime, timedelta
 
+#ISO 8601 extendido, como lo envían los servidores SOS
+ISO_DATETIME = re.compile(r"(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:[.,](\d+))?)?)?(Z|[+-]\d\d(?::?\d\d)?)?$")
+UTC = tzutc()
+_offsets = {}
+
+def parseIsoDateTime (text):
+    """
+    Parse a strict ISO 8601 date and time, same result as dateutil parser
+    :param text: Date and time as yyyy-MM-dd[Thh:mm[:ss[.fff]]][Z|+hh:mm]
+    :type text: str
+    :return: datetime, None if text isn't ISO 8601
+    :rtype: datetime
+    """
+    match = ISO_DATETIME.match(text)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    tzinfo = None
+    if zone:
+        if zone == "Z":
+            tzinfo = UTC
+        else:
+            tzinfo = _offsets.get(zone)
+            if tzinfo == None:
+                offset = (int(zone[1:3]) * 60 + int(zone[-2:] if len(zone) > 3 else 0)) * 60
+                offset = -offset if zone[0] == "-" else offset
+                tzinfo = _offsets[zone] = UTC if offset == 0 else tzoffset(None, offset)
+    try:
+        return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                        int(fraction[:6].ljust(6, "0")) if fraction else 0, tzinfo)
+    except ValueError:
+        return None
+
+def parseEpochMSecs (text):
+    """
+    :param text: Date and time, ISO 8601 or any format known by dateutil
+    :type text: str
+    :return: Epoch milliseconds, times without zone are taken as UTC.
+    None if text isn't a time
+    :rtype: long
+    """
+    key = parseTimeKey(text)
+    return key[0] if key else None
+
+def parseTimeKey (text):
+    """
+    :param text: Date and time, ISO 8601 or any format known by dateutil
+    :type text: str
+    :return: (epoch milliseconds, True if text has zone). Times without
+    zone are taken as UTC. None if text isn't a time
+    :rtype: tuple
+    """
+    try:
+        dt = parseIsoDateTime(text.strip()) or DateTimeParser.parse(text)
+    except Exception:
+        return None
+    return toEpochMSecs(dt), dt.tzinfo != None
+
+def toEpochMSecs (dt):
+    """
+    :param dt: Date and time, without zone it's taken as UTC
+    :type dt: datetime
+    :return: Epoch milliseconds
+    :rtype: long
+    """
+    return calendar.timegm(dt.utctimetuple()) * 1000L + dt.microsecond // 1000
+
+def fromEpochMSecs (epoch):
+    """
+    :param epoch: Epoch milliseconds
+    :type epoch: long
+    :return: Date and time in UTC
+    :rtype: datetime
+    """
+    return datetime(1970, 1, 1, tzinfo=UTC) + timedelta(milliseconds=epoch)
+
+#Límites de "first" y "latest" en milisegundos
+EPOCHS = {"first" : float("-inf"), "latest" : float("inf")}
+
+def _restore (cls, timePrimitive, values):
+    time = object.__new__(cls)
+    time._set(timePrimitive, values)
+    return time
+
+@functools.total_ordering
 class QgsTime (object):
     """
-    Abstract base class for QgsTime types
+    Abstract base class for QgsTime types. Values are immutable, they are
+    compared, hashed and intersected by their UTC epoch milliseconds.
     """
     __metadata__ = abc.ABCMeta
+    __slots__ = ('_timePrimitive', '_values', '_epochs', '_str')
 
     TimeInstant = 1
     TimePeriod = 2
     
     @abc.abstractmethod
     def __init__(self, timePrimitive=0):
-        self._timePrimitive = timePrimitive
-        self._values = ["latest" for _ in range(timePrimitive)]
+        self._set(timePrimitive, ("latest",) * timePrimitive)
+    
+    def _set (self, timePrimitive, values):
+        setter = super(QgsTime, self).__setattr__
+        setter('_timePrimitive', timePrimitive)
+        setter('_values', tuple(values))
+        setter('_epochs', tuple(EPOCHS[dt] if isinstance(dt, str) else toEpochMSecs(dt) if dt else None for dt in self._values))
+        setter('_str', None)
+    
+    def __setattr__ (self, name, value):
+        raise AttributeError("QgsTime values are immutable")
+    
+    __delattr__ = __setattr__
+    
+    def __reduce__ (self):
+        return _restore, (self.__class__, self._timePrimitive, self._values)
         
     def _parse (self, dt):
         """
         :param dt: datetime, latest or first
+        :return: datetime, latest, first or None if dt isn't a time
         """
         if dt in ["latest", "first"]:
-            return dt
+            return str(dt)
         
         try:
-            dt = DateTimeParser.parse(dt)
+            return parseIsoDateTime(dt.strip()) or DateTimeParser.parse(dt)
         except Exception:
-            dt = datetime.today().date()
-            #.utcnow()
-            #dt.replace(tzinfo=pytz.utc)
-        finally:
-            return dt
+            return None
 
     @property
     def primitive (self):
         return self._timePrimitive
     
+    @property
+    def begin (self):
+        """
+        :return: Begin epoch milliseconds, -inf if it's first, None if it's unknown
+        """
+        return self._epochs[0] if self._epochs else None
+    
+    @property
+    def end (self):
+        """
+        :return: End epoch milliseconds, inf if it's latest, None if it's unknown
+        """
+        return self._epochs[-1] if self._epochs else None
+    
+    def _bounds (self, other):
+        if isinstance(other, QgsTime):
+            return other.begin, other.end
+        return other, other
+    
+    def overlaps (self, other):
+        """
+        :param other: Time or epoch milliseconds
+        :type other: QgsTime, long
+        :return: True if both times share some instant, bounds included
+        :rtype: bool
+        """
+        begin, end = self._bounds(other)
+        if None in (self.begin, self.end, begin, end):
+            return False
+        return self.begin <= end and begin <= self.end
+    
+    def contains (self, other):
+        """
+        :param other: Time or epoch milliseconds
+        :type other: QgsTime, long
+        :return: True if other is inside this time, bounds included
+        :rtype: bool
+        """
+        begin, end = self._bounds(other)
+        if None in (self.begin, self.end, begin, end):
+            return False
+        return self.begin <= begin and end <= self.end
+    
+    def __eq__ (self, other):
+        if not isinstance(other, QgsTime):
+            return NotImplemented
+        return self._timePrimitive == other._timePrimitive and self._epochs == other._epochs
+    
+    def __ne__ (self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+    
+    def __lt__ (self, other):
+        if not isinstance(other, QgsTime):
+            return NotImplemented
+        return (self._epochs, self._timePrimitive) < (other._epochs, other._timePrimitive)
+    
+    def __hash__ (self):
+        return hash((self._timePrimitive, self._epochs))
+    
     def _getDate (self, i):
         try:
             return self._values[i].date()
@@ -57,17 +218,19 @@ class QgsTime (object):
             return
 
     def __str__(self):
-        toStr = lambda dt : dt if isinstance (dt, str) else str(dt).replace(" ", "T")
-        return " ".join([toStr(dt) for dt in self._values])
+        if self._str is None:
+            toStr = lambda dt : dt if isinstance (dt, str) else "" if dt is None else str(dt).replace(" ", "T")
+            super(QgsTime, self).__setattr__('_str', " ".join([toStr(dt) for dt in self._values]).strip())
+        return self._str
 
 class QgsTimePeriod (QgsTime):
     """
     Represents a time period with begin date and time and end date and time
     """
+    __slots__ = ()
+    
     def __init__(self, begin="", end=""):
-        super(QgsTimePeriod, self).__init__(QgsTime.TimePeriod)
-        self._values[0] = self._parse(begin)
-        self._values[1] = self._parse(end)
+        self._set(QgsTime.TimePeriod, (self._parse(begin), self._parse(end)))
     
     @property
     def beginDate (self):
@@ -89,9 +252,10 @@ class QgsTimeInstant (QgsTime):
     """
     Represents a time instant
     """
+    __slots__ = ()
+    
     def __init__(self, time=""):
-        super(QgsTimeInstant, self).__init__(QgsTime.TimeInstant)
-        self._values[0] = self._parse(time)
+        self._set(QgsTime.TimeInstant, (self._parse(time),))
     
     @property
     def date (self):
@@ -99,4 +263,4 @@ class QgsTimeInstant (QgsTime):
     
     @property
     def time (self):
-        return self._getTime(0)
\ No newline at end of file
+        return self._getTime(0)
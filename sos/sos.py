@@ -4,30 +4,80 @@
 """
 
 from sosparser import * #@UnusedWildImport
-from qgstime import QgsTimeInstant, QgsTimePeriod
-from PyQt4.QtCore import QUrl, QObject, QFile, pyqtSlot, pyqtSignal, Qt, QVariant
-from PyQt4.QtXml import QDomDocument
-from qgis.core import QgsGeometry, QgsRectangle, QgsOgcUtils, QgsFields, QgsField, QgsFeature, QgsCoordinateReferenceSystem, QGis, QgsVectorFileWriter, QgsVectorLayer
+from qgstime import QgsTimeInstant, QgsTimePeriod, fromEpochMSecs
+from PyQt4.QtCore import QUrl, QObject, QFile, QIODevice, pyqtSlot, pyqtSignal, Qt, QVariant, QDateTime
+from PyQt4.QtXml import QDomDocument, QDomNode
+from qgis.core import QgsGeometry, QgsRectangle, QgsOgcUtils, QgsFields, QgsField, QgsFeature, QgsCoordinateReferenceSystem, QGis, QgsVectorFileWriter, QgsVectorLayer, QgsVectorDataProvider
+from array import array
+from math import isnan, isinf
+from collections import Mapping
+import os
+import copy
+import cPickle
+import hashlib
+import json
+
+NaN = float('nan')
 
 class SensorObservationService (QObject):
     """
     Represent a Sensor Observation Service
     """
-    def __init__(self, url, xmlFile=None):
+    def __init__(self, url, xmlFile=None, snapshotFile=None):
         """
         :param url: Sensor Observation Service URL
         :type str
         :param xmlFile: XML capabilities filename
         :type str
+        :param snapshotFile: Parsed capabilities filename. It's loaded instead of
+        parsing xmlFile if it was saved from the same XML, else it's rewritten
+        :type str
         """
         super (SensorObservationService, self).__init__()
         
         self._url = url
         self._capabilities = SOSCapabilities ()
         
-        if xmlFile:
+        if xmlFile and snapshotFile:
+            self._capabilities = self._loadSnapshot (xmlFile, snapshotFile)
+        elif xmlFile:
             xml = QFile (xmlFile)
             self._capabilities = XMLParserFactory.getInstance("SOSCapabilities")().parse(xml)
+    
+    @staticmethod
+    def _loadSnapshot (xmlFile, snapshotFile):
+        """
+        Snapshot file holds the SHA-1 of the XML followed by the pickled capabilities
+        """
+        digest = hashlib.sha1()
+        with open (xmlFile, "rb") as xml:
+            for chunk in iter(lambda: xml.read(1 << 16), ""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        
+        try:
+            with open (snapshotFile, "rb") as snapshot:
+                if cPickle.load(snapshot) == digest:
+                    capabilities = cPickle.load(snapshot)
+                    #El XML guardado puede ser otro fichero con el mismo contenido
+                    capabilities.xml = QFile (xmlFile)
+                    return capabilities
+        except Exception:
+            #No existe o no es válido, se vuelve a generar
+            pass
+        
+        capabilities = XMLParserFactory.getInstance("SOSCapabilities")().parse(QFile (xmlFile))
+        try:
+            with open (snapshotFile, "wb") as snapshot:
+                cPickle.dump(digest, snapshot, cPickle.HIGHEST_PROTOCOL)
+                cPickle.dump(capabilities, snapshot, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            #Sin instantánea se analiza el XML en la próxima conexión
+            try:
+                os.remove(snapshotFile)
+            except OSError:
+                pass
+        return capabilities
 
     @staticmethod
     def capabilitiesUrl(url):
@@ -294,6 +344,51 @@ class SensorObservationService (QObject):
         root.appendChild (responseMode)
         
         return doc.toString(4)
+    
+    @staticmethod
+    def getObservationsAfter (xml, time):
+        """
+        Replace the temporal filter of a GetObservation request by TM_After time
+        :param xml: GetObservation request, as returned by getObservations
+        :type xml: str
+        :param time: Only observations later than time are requested
+        :type time: QDateTime
+        :return: xml data
+        """
+        doc = QDomDocument()
+        if not doc.setContent(xml):
+            raise ValueError ("Invalid GetObservation request")
+        root = doc.documentElement()
+        
+        #Los filtros temporales van tras la última oferta
+        offering = None
+        node = root.firstChild()
+        while not node.isNull():
+            nextNode = node.nextSibling()
+            localName = node.nodeName().split(":")[-1]
+            if localName == "offering":
+                offering = node
+            elif localName == "eventTime":
+                root.removeChild(node)
+            node = nextNode
+        
+        timeEvent = doc.createElement("eventTime")
+        operator = doc.createElement("ogc:TM_After")
+        prop = doc.createElement("ogc:PropertyName")
+        prop.appendChild (doc.createTextNode ("om:samplingTime"))
+        operand = doc.createElement("gml:TimeInstant")
+        timePos = doc.createElement("gml:timePosition")
+        timePos.appendChild(doc.createTextNode(time.toUTC().toString("yyyy-MM-dd'T'hh:mm:ss.zzz'Z'")))
+        operand.appendChild (timePos)
+        timeEvent.appendChild(operator)
+        operator.appendChild (prop)
+        operator.appendChild (operand)
+        if offering:
+            root.insertAfter(timeEvent, offering)
+        else:
+            root.insertBefore(timeEvent, root.firstChild())
+        
+        return doc.toString(4)
         
 class SOSCapabilities ():
     """
@@ -306,7 +401,19 @@ class SOSCapabilities ():
         self.serviceProvider = None
         self.operationsMetadata = {}
         self.filterCapabilities = None
-        self.observationOfferingList = {}
+        self.observationOfferingList = SOSObservationOfferingList()
+    
+    def __getstate__ (self):
+        state = self.__dict__.copy()
+        #Solo el nombre del fichero XML
+        if isinstance(self.xml, QFile):
+            state['xml'] = self.xml.fileName()
+        return state
+    
+    def __setstate__ (self, state):
+        self.__dict__.update(state)
+        if self.xml:
+            self.xml = QFile(self.xml)
 
 class SOSServiceIdentification (QObject):
     """
@@ -319,6 +426,9 @@ class SOSServiceIdentification (QObject):
         self.keywords = []
         self.serviceType = ""
         self.serviceTypeVersion = ""
+    
+    def __reduce__ (self):
+        return (SOSServiceIdentification, (), self.__dict__.copy())
 
     def __unicode__ (self):
         return "".join(
@@ -345,6 +455,9 @@ class SOSServiceProvider (QObject):
         self.phones = {}
         self.address = {}
     
+    def __reduce__ (self):
+        return (SOSServiceProvider, (), self.__dict__.copy())
+    
     def __unicode__ (self):
         return "".join(
                          map (lambda title, text:
@@ -395,11 +508,84 @@ class SOSObservationOffering ():
         self.responseFormats = []
         self.observationTypes = []
         self.featureOfInterestType = ""
+    
+    def __getstate__ (self):
+        state = self.__dict__.copy()
+        if isinstance(self.observedArea, QgsRectangle):
+            rect = self.observedArea
+            state['observedArea'] = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        return state
+    
+    def __setstate__ (self, state):
+        self.__dict__.update(state)
+        if isinstance(self.observedArea, tuple):
+            self.observedArea = QgsRectangle(*self.observedArea)
+
+class SOSObservationOfferingList (Mapping):
+    """
+    Observation offerings by identifier. Capabilities parser only indexes
+    offering nodes, each offering is parsed on first access. Snapshots keep
+    unparsed offerings as XML text.
+    """
+    def __init__(self):
+        self._offerings = {}
+    
+    def addNode (self, identifier, node):
+        """
+        :param identifier: Offering identifier
+        :type identifier: str
+        :param node: ObservationOffering node, parsed when it's first requested
+        :type node: QDomNode
+        """
+        self._offerings[identifier] = node
+    
+    def __setitem__ (self, identifier, offering):
+        self._offerings[identifier] = offering
+    
+    def __getitem__ (self, identifier):
+        offering = self._offerings[identifier]
+        if isinstance(offering, basestring):
+            #Nodo guardado como texto en una instantánea
+            doc = QDomDocument()
+            doc.setContent(offering, True)
+            offering = doc.documentElement()
+        if isinstance(offering, QDomNode):
+            offering = self._offerings[identifier] = XMLParserFactory.getInstance ("SOSObservationOffering")().parse(offering)
+        return offering
+    
+    def __iter__ (self):
+        return iter(self._offerings)
+    
+    def __len__ (self):
+        return len(self._offerings)
+    
+    def __contains__ (self, identifier):
+        return identifier in self._offerings
+    
+    def keys (self):
+        return self._offerings.keys()
+    
+    def __getstate__ (self):
+        #Los nodos no se pueden serializar, se guardan como texto sin analizar
+        state = {}
+        for identifier, offering in self._offerings.items():
+            if isinstance(offering, QDomNode):
+                doc = QDomDocument()
+                doc.appendChild(doc.importNode(offering, True))
+                offering = doc.toString(-1)
+            state[identifier] = offering
+        return state
+    
+    def __setstate__ (self, state):
+        self._offerings = state
         
 class FilterRequest (object):
     """
     Filter request: Spatial, Temporal and Scalar with Operator and Operands
     """
+    #Spatial operators whose envelope can be split in tiles, see spatialTiles
+    tileOperators = ["BBOX", "Intersects"]
+    
     def __init__(self, service):
         assert isinstance(service, SensorObservationService)        
         self._service = service
@@ -488,6 +674,77 @@ class FilterRequest (object):
     @scalarValue.setter        
     def scalarValue (self, value):
         self._scalarValue = value
+    
+    def spatialTiles (self, columns, rows = None, extent = None):
+        """
+        Split the envelope of the spatial filter in a grid. If spatial filter
+        isn't set, extent is split with BBOX filters. Only operators in
+        tileOperators are split, others don't give the same observations
+        when tiles results are joined.
+        :param columns: Tiles by row
+        :type columns: int
+        :param rows: Tiles by column, same as columns if None
+        :type rows: int
+        :param extent: Area to split without spatial filter, usually offering observedArea
+        :type extent: QgsRectangle
+        :return: A copy of this filter by tile, or only this filter if it
+        can't be split
+        :rtype: FilterRequest list
+        """
+        rows = rows if rows else columns
+        if self.spatialFilter:
+            if self.spatialOperator not in self.tileOperators:
+                return [self]
+            if self.spatialOperand != "gml:Envelope" or not isinstance(self._spatialValue, QgsRectangle):
+                return [self]
+            extent = self._spatialValue
+            operator = self.spatialOperator
+        elif self.spatialFilter == False and "BBOX" in self._service.spatialOperators and "gml:Envelope" in self._service.spatialOperands:
+            operator = "BBOX"
+        else:
+            return [self]
+        if columns * rows <= 1 or not extent or extent.isEmpty():
+            return [self]
+        
+        width = extent.width() / columns
+        height = extent.height() / rows
+        tiles = []
+        for i in range(columns):
+            for j in range(rows):
+                request = copy.copy(self)
+                request.spatialFilter = True
+                request.spatialOperator = operator
+                request.spatialOperand = "gml:Envelope"
+                request._spatialValue = QgsRectangle (extent.xMinimum() + i * width, extent.yMinimum() + j * height,
+                                                      extent.xMinimum() + (i + 1) * width, extent.yMinimum() + (j + 1) * height)
+                tiles.append(request)
+        return tiles
+    
+    def temporalWindows (self, window):
+        """
+        Split a TM_During time period filter in consecutive periods
+        :param window: Period length
+        :type window: timedelta
+        :return: A copy of this filter by period, or only this filter if it
+        can't be split
+        :rtype: FilterRequest list
+        """
+        if not self.temporalFilter or self.temporalOperator != "TM_During" or self.temporalOperand != "gml:TimePeriod":
+            return [self]
+        period = self._temporalValue
+        begin, end = (period.begin, period.end) if period else (None, None)
+        step = window.days * 86400000L + window.seconds * 1000L + window.microseconds // 1000
+        #Épocas en UTC, los extremos pueden tener o no zona
+        if None in (begin, end) or isinf(begin) or isinf(end) or step <= 0 or end - begin <= step:
+            return [self]
+        
+        windows = []
+        while begin < end:
+            request = copy.copy(self)
+            request._temporalValue = QgsTimePeriod (fromEpochMSecs(begin).isoformat(), fromEpochMSecs(min(begin + step, end)).isoformat())
+            windows.append(request)
+            begin += step
+        return windows
 
     def __str__(self):
         return "Spatial: {} {} {} {}; Temporal: {} {} {} {}; Scalar: {} {} {} {}".format(self.spatialFilter,self.spatialOperator, self.spatialOperand, self.spatialValue, self.temporalFilter, self.temporalOperator, self.temporalOperand, self.temporalValue, self.scalarFilter, self.scalarOperator, self.scalarOperand, self.scalarValue)
@@ -512,89 +769,349 @@ class ExceptionReport(Exception):
     def __str__(self):
         return self.exceptionCode + ": " + self.exceptionText
     
+class FeatureOfInterestKey (object):
+    """
+    Observations key: feature of interest id and depth, if any
+    Text and hash are those of the former unicode keys, foi or (foi, depth)
+    """
+    __slots__ = ('foi', 'depth', '_text')
+    
+    def __init__(self, foi, depth = None):
+        """
+        :param foi: Feature Of Interest id
+        :type foi: str
+        :param depth: Sampling point depth
+        :type depth: str
+        """
+        self.foi = unicode(foi)
+        self.depth = unicode(depth) if depth != None else None
+        self._text = self.foi if self.depth == None else unicode((self.foi, self.depth))
+    
+    def __hash__ (self):
+        return hash(self._text)
+    
+    def __eq__ (self, other):
+        return isinstance(other, FeatureOfInterestKey) and self.foi == other.foi and self.depth == other.depth
+    
+    def __ne__ (self, other):
+        return not self == other
+    
+    def __unicode__ (self):
+        return self._text
+    
+    def __repr__ (self):
+        return "FeatureOfInterestKey({!r}, {!r})".format(self.foi, self.depth)
+    
 class SOSProvider (object):
     """
     Fake QgsVectorDataProvider
+    Observations are stored by columns: feature of interest code, time as epoch
+    milliseconds, whether the time had zone and one column by observed property.
+    Properties declared as Double or Int are stored in double arrays, with NaN
+    as missing value. Any other property keeps its values as given.
+    Rows of each feature of interest key are also kept sorted by time.
     """
+    #Field types stored in double arrays
+    numericTypes = (QVariant.Double, QVariant.Int)
+    
     def __init__(self):
         self.srsName = ""
         self.extent = QgsRectangle () 
         self.features = {}
         self.fields = [QgsField("foi", QVariant.String), QgsField("name", QVariant.String)]
-        self._observations = {}
         self.only1stGeo = False
+        self._fois = []
+        self._foiCodes = {}
+        self._rows = []
+        self._timeOrder = []
+        self._unsorted = set()
+        self._foiColumn = array('i')
+        self._timeColumn = array('d')
+        self._zoneColumn = array('b')
+        self._properties = []
+        self._propertyColumns = {}
         
-    def setObservation (self, foi, time, observedProperty, value):
+    @property
+    def featureCount (self):
+        """
+        Number of observations (foi, time) stored
+        """
+        return len(self._foiColumn)
+    
+    @property
+    def lastTime (self):
+        """
+        Latest observation time as epoch milliseconds, None without observations
+        """
+        times = [time for time in self._timeColumn if not isnan(time)]
+        return long(max(times)) if len(times) else None
+        
+    def setObservation (self, foi, time, observedProperty, value, fieldType = None):
         """
         :param foi: Feature Of Interest
-        :type foi: str
-        :param time: Phenomenom Time
-        :type time: str
+        :type foi: FeatureOfInterestKey or str
+        :param time: Phenomenom Time as epoch milliseconds, or (epoch
+        milliseconds, has zone) as given by parseTimeKey. None if unknown.
+        QDateTime is also accepted
+        :type time: long or tuple
         :param observedProperty: Property
         :type observedProperty: str
         :param value: observed value
-        :type value: float
+        :type value: str
+        :param fieldType: Declared type of the property field, the column
+        storage is chosen by the first observation of each property
+        :type fieldType: QVariant.Type
         """
+        size = len(self._timeColumn)
+        row = self._row(foi, time)
+        if row == size:
+            for column in self._propertyColumns.values():
+                column.append(NaN if isinstance(column, array) else None)
+        
+        column = self._propertyColumn(observedProperty, fieldType)
+        column[row] = self._number(value) if isinstance(column, array) else value
+            
+    def setObservations (self, fois, times, observedProperty, values, fieldType = None):
+        """
+        Set observed values of a property, a column by parameter. New rows
+        are added to every column at once.
+        :param fois: Features Of Interest
+        :type fois: str list
+        :param times: Phenomenom Times, see setObservation
+        :type times: long list
+        :param observedProperty: Property
+        :type observedProperty: str
+        :param values: observed values
+        :type values: str list
+        :param fieldType: Declared type of the property field
+        :type fieldType: QVariant.Type
+        """
+        size = len(self._timeColumn)
+        rows = self._addRows(fois, times)
+        added = len(self._timeColumn) - size
+        
+        column = self._propertyColumn(observedProperty, fieldType)
+        if isinstance(column, array):
+            try:
+                values = array('d', map(float, values))
+            except (TypeError, ValueError):
+                values = array('d', map(self._number, values))
+        if added == len(rows):
+            #Todas las filas son nuevas y consecutivas
+            column[size:] = values
+        else:
+            for row, value in zip(rows, values):
+                column[row] = value
+    
+    def _addRows (self, fois, times):
+        """
+        Rows of several observations, new rows are added to every column
+        :return: Row numbers
+        :rtype: int list
+        """
+        size = len(self._timeColumn)
+        rows = map(self._row, fois, times)
+        added = len(self._timeColumn) - size
+        if added:
+            for column in self._propertyColumns.values():
+                column.extend(array('d', [NaN]) * added if isinstance(column, array) else [None] * added)
+        return rows
+    
+    def merge (self, other):
+        """
+        Add the observations of another provider, as if its document had been
+        parsed into this one. Fields missing here are added, extents are combined
+        and observed values replace those of the same (foi, time) row.
+        :param other: Provider of another document
+        :type other: SOSProvider
+        """
+        if not self.srsName:
+            self.srsName = other.srsName
+        if self.extent.isEmpty():
+            self.extent = QgsRectangle(other.extent)
+        elif not other.extent.isEmpty():
+            self.extent.combineExtentWith(other.extent)
+        self.features.update(other.features)
+        names = [f.name() for f in self.fields]
+        self.fields.extend([f for f in other.fields if not f.name() in names])
+        
+        fois = [other._fois[code] for code in other._foiColumn]
+        times = [(long(time) if not isnan(time) else None, bool(zoned)) for time, zoned in zip(other._timeColumn, other._zoneColumn)]
+        #Todas las filas, aunque no tengan valores observados
+        self._addRows(fois, times)
+        for observedProperty in other._properties:
+            column = other._propertyColumns[observedProperty]
+            numeric = isinstance(column, array)
+            #Solo los valores observados, los ausentes no reemplazan a los de otro documento
+            rows = [row for row, value in enumerate(column) if not (isnan(value) if numeric else value is None)]
+            self.setObservations([fois[row] for row in rows], [times[row] for row in rows], observedProperty,
+                                 [column[row] for row in rows], QVariant.Double if numeric else None)
+    
+    def _row (self, foi, time):
+        """
+        Row of an observation. If it's new, it's added to feature of interest
+        and time columns, but not to property columns
+        :return: Row number
+        :rtype: int
+        """
+        if not isinstance(foi, FeatureOfInterestKey):
+            foi = FeatureOfInterestKey(foi)
         try:
-            timeList, propertiesList = self._observations[foi]
-            propertiesList[timeList.index(time)][observedProperty] = value    
-        except ValueError:
-            #Ya existe registro para la foi, pero no para time
-            timeList.append(time)
-            propertiesList.append({observedProperty: value})
+            code = self._foiCodes[foi]
         except KeyError:
             #No existe registro para la foi
-            timeList = []
-            propertiesList = []
-            self._observations[foi] = (timeList,propertiesList)
-            timeList.append(time)
-            propertiesList.append({observedProperty: value})
+            code = self._foiCodes[foi] = len(self._fois)
+            self._fois.append(foi)
+            self._rows.append({})
+            self._timeOrder.append(array('i'))
+        
+        #Registros de la foi indexados por time
+        if isinstance(time, QDateTime):
+            #Sin zona se toma como UTC, igual que parseTimeKey
+            zoned = time.timeSpec() != Qt.LocalTime
+            time = (epochMSecs(time if zoned else QDateTime(time.date(), time.time(), Qt.UTC)), zoned) if time.isValid() else None
+        key, zoned = time if isinstance(time, tuple) else (time, True)
+        rows = self._rows[code]
+        try:
+            return rows[key]
+        except KeyError:
+            #Ya existe registro para la foi, pero no para time
+            row = rows[key] = len(self._timeColumn)
+            timeOrder = self._timeOrder[code]
+            if len(timeOrder) and not self._timeColumn[timeOrder[-1]] <= key:
+                self._unsorted.add(code)
+            timeOrder.append(row)
+            self._foiColumn.append(code)
+            self._timeColumn.append(key if key != None else NaN)
+            self._zoneColumn.append(zoned)
+            return row
+    
+    def _propertyColumn (self, observedProperty, fieldType):
+        """
+        :return: Column of a property, created empty by fieldType if it doesn't exist
+        :rtype: array or list
+        """
+        try:
+            return self._propertyColumns[observedProperty]
+        except KeyError:
+            self._properties.append(observedProperty)
+            column = self._propertyColumns[observedProperty] = self._column(fieldType, len(self._timeColumn))
+            return column
+    
+    @classmethod
+    def _column (cls, fieldType, size):
+        """
+        :return: Empty property column for a field type
+        :rtype: array or list
+        """
+        if fieldType in cls.numericTypes:
+            return array('d', [NaN]) * size
+        return [None] * size
+    
+    @staticmethod
+    def _number (value):
+        """
+        :return: value as float, NaN if it isn't numeric
+        """
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            #Valor no numérico en un campo numérico, se toma como ausente
+            return NaN
+    
+    def _value (self, observedProperty, row):
+        """
+        :return: Observed value or None if missing
+        """
+        try:
+            value = self._propertyColumns[observedProperty][row]
+        except KeyError:
+            return None
+        if isinstance(value, float) and isnan(value):
+            return None
+        return value
+    
+    def _time (self, row):
+        """
+        :return: Time of a row as ISO 8601, in UTC with Z if it had zone.
+        Empty if unknown
+        :rtype: str
+        """
+        time = self._timeColumn[row]
+        if isnan(time):
+            return ""
+        time = QDateTime.fromMSecsSinceEpoch(long(time)).toUTC()
+        return str(time.toString(Qt.ISODate) if self._zoneColumn[row] else time.toString("yyyy-MM-dd'T'hh:mm:ss"))
             
     def getObservation (self, foi="", time = None):
         """
         Only for testing purposes!
         """
         text = ""
-        for foi in self._observations.keys():
-            text += ";" + foi + ": " 
-            timeList, propertiesList = self._observations[foi]
-            for i in range(len(timeList)):
-                text += str(timeList[i].toString(Qt.ISODate)) + "-" + str(propertiesList[i]) + ","
+        for foi in self._foiCodes.keys():
+            text += ";" + unicode(foi) + ": " 
+            for row in sorted(self._rows[self._foiCodes[foi]].values()):
+                properties = {}
+                for prop in self._properties:
+                    value = self._value(prop, row)
+                    if value != None:
+                        properties[prop] = repr(value) if isinstance(value, float) else value
+                text += self._time(row) + "-" + str(properties) + ","
         return text
     
-    def getFeatures (self):
+    def _sortedRows (self, code):
         """
+        :return: Rows of a feature of interest key sorted by time
+        """
+        if code in self._unsorted:
+            timeOrder = self._timeOrder[code]
+            #Sin tiempo primero, NaN no se puede ordenar
+            self._timeOrder[code] = array('i', sorted(timeOrder, key=lambda row: (not isnan(self._timeColumn[row]), self._timeColumn[row])))
+            self._unsorted.discard(code)
+        return self._timeOrder[code]
+    
+    def getFeatures (self, after = None):
+        """
+        Features of each feature of interest sorted by time. Fields are foi,
+        name, Time and observed properties, the parsers always add Time.
+        Observations without time have it empty, come first and are skipped
+        if after is given, as they can't be compared with it.
+        :param after: Only observations later than this epoch milliseconds
+        :type after: long
         :return QgsFeaures generator
         """
         fields = QgsFields()
         map (fields.append, self.fields)
-        foiIds = {foiId : [] for foiId in self.features}
-        try:
-            idIsTuple = isinstance (eval(self._observations.keys()[0]),tuple)
-        except:
-            idIsTuple = False
-        if idIsTuple:
-            map (lambda x: foiIds[eval(x)[0]].append(x), self._observations.keys())
-        else:
-            map (lambda x: foiIds[x].append(x), self.features)
+        foiKeys = {}
+        for code, key in enumerate(self._fois):
+            foiKeys.setdefault(key.foi, []).append(code)
+        
+        columns = [self._propertyColumns.get(unicode(f.name()), []) for f in self.fields[3:]]
+        timeStrings = {}
         for foi in self.features:
             name, geo = self.features[foi]
-            for foi_id in foiIds[foi]:
-                timeList, propertiesList = self._observations[foi_id]
-                #for i,t in enumerate(timeList):
-                for i, t in sorted({i:t for i,t in enumerate(timeList)}.items(), key=lambda x:x[1]):
+            for code in foiKeys.get(foi, []):
+                for row in self._sortedRows(code):
+                    #NaN, sin tiempo, no es posterior a after
+                    if after != None and not self._timeColumn[row] > after:
+                        continue
                     values = []
-                    for f in self.fields[3:]: #TODO si no tiene time esto no va a funcionar...
+                    for column in columns:
                         try:
-                            values.append(propertiesList[i][str(f.name())])
-                        except KeyError:
-                            values.append (f.name())
+                            value = column[row]
+                            values.append (None if isinstance(value, float) and isnan(value) else value)
+                        except IndexError:
+                            values.append (None)
+                    
+                    time = (self._timeColumn[row], self._zoneColumn[row])
+                    if not time in timeStrings:
+                        timeStrings[time] = self._time(row)
                     
                     feature = QgsFeature (fields)
                     if geo:
                         feature.setGeometry (geo)
                         if self.only1stGeo: geo = None
-                    feature.setAttributes([foi, name, t.toString(Qt.ISODate)] + values)
+                    feature.setAttributes([foi, name, timeStrings[time]] + values)
                     yield feature
                 
 class ObservationsLayer (QObject):
@@ -603,8 +1120,22 @@ class ObservationsLayer (QObject):
     """
     finished = pyqtSignal ()
     failed = pyqtSignal (unicode)
+    progress = pyqtSignal (int, int)
+    
+    #Layer storage
+    GeoJSON = "GeoJSON"
+    Memory = "memory"
+    GeoPackage = "GPKG"
+    SpatiaLite = "SQLite"
+    
+    #Features added by call to memory provider
+    batchSize = 10000
+    #Bytes read by step when parsing as stream
+    chunkSize = 1 << 20
+    #Features written between progress signals
+    progressStep = 1000
     
-    def __init__(self, name = "Observations", xmlFile=None, only1stGeo = False):
+    def __init__(self, name = "Observations", xmlFile=None, only1stGeo = False, stream = False, storage = GeoJSON):
         """
         :param name Layer name
         :type str
@@ -612,41 +1143,275 @@ class ObservationsLayer (QObject):
         :type str
         :param only1stGeo If True only first occurrence by foi will include geometric data 
         :type bool
+        :param stream If True XML is parsed member by member instead of loading the whole document
+        :type bool
+        :param storage Layer storage: GeoJSON, Memory, GeoPackage or SpatiaLite
+        :type str
         """
         super (ObservationsLayer, self).__init__()
         self._name = name
-        self.features = []
         self.provider = None
         self.xmlFile = xmlFile
         self._layer = None
         self._error = None
         self._only1stGeo = only1stGeo
+        self._stream = stream
+        self._storage = storage
+        self._canceled = False
+        self._fileName = None
+        self._parsers = {}
+        self._sourceErrors = {}
+        #Petición de la capa, para actualizarla con refreshRequests
+        self.requestUrl = ""
+        self.requests = []
+        #El servicio admite TM_After
+        self.afterFilter = False
         
     @property
     def name (self):
         return self._name
     
+    @property
+    def canceled (self):
+        return self._canceled
+    
+    def cancel (self):
+        """
+        Stop layer generation. It's checked between chunks, so it can be called
+        from a thread other than the one running toVectorLayer (connect with
+        Qt.DirectConnection)
+        """
+        self._canceled = True
+    
+    @property
+    def sourceErrors (self):
+        """
+        Errors by source of the data added, sources which failed are skipped
+        if any other succeeds
+        :rtype: dict
+        """
+        return dict((source, unicode(error)) for source, error in self._sourceErrors.items())
+    
+    def addData (self, data, source = None):
+        """
+        Parse a chunk of the XML observations as it's downloaded. If data has
+        been added, toVectorLayer uses the observations already parsed instead
+        of reading xmlFile, which is only used to name the layer files.
+        Observations from several documents, one by source, are parsed apart
+        and merged by toVectorLayer, so a source can be discarded until then.
+        Parse errors are raised later by toVectorLayer.
+        :param data: XML chunk
+        :type data: QByteArray or str
+        :param source: Document identifier, any hashable value
+        """
+        if source in self._sourceErrors:
+            return
+        try:
+            if not source in self._parsers:
+                self._parsers[source] = XMLParserFactory.getInstance("SOSObservationsStream")()
+            self._parsers[source].addData(data)
+        except Exception as error:
+            self._parsers.pop(source, None)
+            self._sourceErrors[source] = error
+    
+    def discardSource (self, source):
+        """
+        Forget observations, parser state and error of source, so the layer
+        is built without it or its document can be added again from the
+        beginning. Sources already merged by toVectorLayer can't be discarded.
+        """
+        self._parsers.pop(source, None)
+        self._sourceErrors.pop(source, None)
+    
     @pyqtSlot ()    
     def toVectorLayer (self):
         """
         Generate QgsVectorLayer
+        progress signal is emitted with KiB read while parsing as stream, and
+        then with features written.
         """
+        self._canceled = False
         try:
-            if self.xmlFile:
-                xml = QFile (self.xmlFile)
-                self.provider = XMLParserFactory.getInstance("SOSObservations")().parse(xml)
-                self.provider.only1stGeo = self._only1stGeo
+            self._parse()
             
-            layer = self._toVectorLayer_geojson()
+            if self._storage == self.Memory:
+                layer = self._toVectorLayer_memory()
+            elif self._storage == self.GeoPackage:
+                layer = self._toVectorLayer_ogr("GPKG", ".gpkg")
+            elif self._storage == self.SpatiaLite:
+                layer = self._toVectorLayer_ogr("SQLite", ".sqlite", ["SPATIALITE=YES"])
+            else:
+                layer = self._toVectorLayer_geojson()
             layer.setCustomProperty("xml", self.xmlFile)
+            if self.requestUrl:
+                layer.setCustomProperty("sosUrl", self.requestUrl)
+                layer.setCustomProperty("sosRequests", json.dumps(self.requests))
+                layer.setCustomProperty("sosLastTime", str(self.provider.lastTime or ""))
+                layer.setCustomProperty("sosAfterFilter", "TM_After" if self.afterFilter else "")
             self._layer = layer
             self._error = None
         except Exception as error: 
+            self._release()
             self._layer = None
             self._error = unicode(error)
         finally:
             self.finished.emit()
     
+    def _parse (self):
+        """
+        Finish parsers of data added, or parse xmlFile
+        """
+        if self._parsers or self._sourceErrors:
+            parsers, self._parsers = self._parsers, {}
+            providers = []
+            for source, parser in parsers.items():
+                try:
+                    providers.append(parser.finish())
+                except Exception as error:
+                    self._sourceErrors[source] = error
+            if len(self._sourceErrors) == len(set(parsers) | set(self._sourceErrors)):
+                raise self._sourceErrors.values()[0]
+            for provider in providers:
+                if self.provider:
+                    self.provider.merge(provider)
+                else:
+                    self.provider = provider
+            self.provider.only1stGeo = self._only1stGeo
+        elif self.xmlFile:
+            xml = QFile (self.xmlFile)
+            if self._stream:
+                self.provider = self._parseChunks(xml)
+            else:
+                self.provider = XMLParserFactory.getInstance("SOSObservations")().parse(xml)
+            self.provider.only1stGeo = self._only1stGeo
+    
+    @staticmethod
+    def refreshRequests (layer):
+        """
+        Requests for observations later than those of a layer, see appendTo.
+        If the service doesn't support TM_After the stored requests are
+        returned as they are, and appendTo must skip the observations loaded.
+        :param layer: Layer generated by toVectorLayer from requests
+        :type layer: QgsVectorLayer
+        :return: GetObservation URL, requests and latest time loaded as epoch
+        milliseconds. Empty URL if layer wasn't generated from requests
+        :rtype: (str, str list, long)
+        """
+        url = layer.customProperty("sosUrl", "")
+        if not url:
+            return ("", [], None)
+        lastTime = layer.customProperty("sosLastTime", "")
+        lastTime = long(lastTime) if lastTime else None
+        requests = json.loads(layer.customProperty("sosRequests", "[]"))
+        if lastTime != None and layer.customProperty("sosAfterFilter", "") == "TM_After":
+            #Las ventanas temporales de una misma petición quedan iguales
+            after = QDateTime.fromMSecsSinceEpoch(lastTime)
+            requests = list(set(SensorObservationService.getObservationsAfter(xml, after) for xml in requests))
+        return (url, requests, lastTime)
+    
+    @staticmethod
+    def appendable (layer):
+        """
+        :param layer: Any layer
+        :type layer: QgsMapLayer
+        :return: True if layer was generated from requests and features can be
+        added to it, so it can be refreshed. GeoJSON layers are read only
+        :rtype: bool
+        """
+        return isinstance(layer, QgsVectorLayer) and layer.customProperty("sosUrl", "") != "" and \
+               bool(layer.dataProvider().capabilities() & QgsVectorDataProvider.AddFeatures)
+    
+    def appendTo (self, layer, after = None):
+        """
+        Add the observations of the data added to a layer generated before,
+        fields missing in layer are also added. Its latest time is updated.
+        :param layer: Layer generated by toVectorLayer
+        :type layer: QgsVectorLayer
+        :param after: Only observations later than this epoch milliseconds are added
+        :type after: long
+        :return: Number of features added
+        :rtype: int
+        """
+        self._parse()
+        if not self.provider:
+            return 0
+        provider = layer.dataProvider()
+        if not provider.capabilities() & QgsVectorDataProvider.AddFeatures:
+            raise Exception (self.tr("Features can't be added to layer {}").format(layer.name()))
+        names = [f.name() for f in layer.pendingFields()]
+        missing = [f for f in self.provider.fields if not f.name() in names]
+        if len(missing) and provider.capabilities() & QgsVectorDataProvider.AddAttributes:
+            provider.addAttributes(missing)
+            layer.updateFields()
+        fields = layer.pendingFields()
+        
+        added = 0
+        features = []
+        for feature in self.provider.getFeatures(after):
+            newFeature = QgsFeature (fields)
+            for field, value in zip(self.provider.fields, feature.attributes()):
+                index = fields.indexFromName(field.name())
+                if index >= 0:
+                    newFeature.setAttribute(index, value)
+            if feature.geometry():
+                newFeature.setGeometry(QgsGeometry(feature.geometry()))
+            features.append(newFeature)
+            if len(features) >= self.batchSize:
+                provider.addFeatures(features)
+                added += len(features)
+                features = []
+        if len(features):
+            provider.addFeatures(features)
+            added += len(features)
+        layer.updateExtents()
+        
+        lastTime = self.provider.lastTime
+        if lastTime != None and (after == None or lastTime > after):
+            layer.setCustomProperty("sosLastTime", str(lastTime))
+        return added
+    
+    def _checkCanceled (self):
+        if self._canceled:
+            raise Exception (self.tr("Layer load canceled"))
+    
+    def _release (self):
+        """
+        Free parsed observations and remove the file partially written
+        """
+        self.provider = None
+        if self._fileName and os.path.exists(self._fileName):
+            try:
+                os.remove(self._fileName)
+            except OSError:
+                pass
+        self._fileName = None
+    
+    def _parseChunks (self, xml):
+        if not xml.open(QIODevice.ReadOnly):
+            raise IOError (xml.errorString())
+        try:
+            parser = XMLParserFactory.getInstance("SOSObservationsStream")()
+            total = xml.size() >> 10
+            while not xml.atEnd():
+                self._checkCanceled()
+                parser.addData(xml.read(self.chunkSize))
+                self.progress.emit(xml.pos() >> 10, total)
+            return parser.finish()
+        finally:
+            xml.close()
+    
+    def _features (self):
+        """
+        provider.getFeatures emitting progress and checking cancellation
+        """
+        total = self.provider.featureCount
+        for done, feature in enumerate(self.provider.getFeatures(), 1):
+            if done % self.progressStep == 0:
+                self._checkCanceled()
+                self.progress.emit(done, total)
+            yield feature
+        self.progress.emit(total, total)
+    
     @property
     def vectorLayer (self):
         if self._layer:
@@ -660,32 +1425,66 @@ class ObservationsLayer (QObject):
             self._error = self.tr("Invalid layer")
         return self._error if self._error else ""
     
-#     def toVectorLayer_sqlite (self):        
-#         crs = QgsCoordinateReferenceSystem()
-#         crs.createFromUserInput(self.provider.srsName)
-#         
-#         fileName = self.xmlFile.replace(".xml", ".sqlite")
-#         fields = QgsFields ()
-#         map (fields.append, self.provider.fields)
-#         writer = QgsVectorFileWriter (fileName, "utf-8", fields, QGis.WKBPoint, crs, "SQLite")
-# 
-#         if writer.hasError() != QgsVectorFileWriter.NoError:
-#             raise Exception (writer.errorMessage())
-#         
-#         for feature in self.provider.getFeatures():
-#             
-#             self.features.append(feature)
-#             writer.addFeature(feature)
-#         
-#         del writer #Forzar escritura a disco
-#         
-#         return QgsVectorLayer( fileName, self.name, "ogr")
+    def _toVectorLayer_ogr (self, driverName, extension, options = []):
+        """
+        Write features to a SQLite based file, GeoPackage or SpatiaLite, in one
+        transaction and create attribute indexes on foi and Time
+        """
+        from osgeo import ogr, osr, gdal
+        
+        crs = QgsCoordinateReferenceSystem()
+        crs.createFromUserInput(self.provider.srsName)
+        srs = None
+        if crs.isValid():
+            srs = osr.SpatialReference()
+            srs.ImportFromWkt(str(crs.toWkt()))
+        
+        fileName = self.xmlFile.replace(".xml", extension)
+        self._fileName = fileName
+        driver = ogr.GetDriverByName(driverName)
+        if not driver:
+            raise Exception ("OGR driver {} not available".format(driverName))
+        if os.path.exists(fileName):
+            driver.DeleteDataSource(fileName)
+        dataSource = driver.CreateDataSource(fileName, options)
+        if not dataSource:
+            raise Exception (gdal.GetLastErrorMsg() or fileName)
+        
+        tableName = "observations"
+        ogrLayer = dataSource.CreateLayer(tableName, srs, ogr.wkbPoint)
+        for field in self.provider.fields:
+            ogrLayer.CreateField(ogr.FieldDefn(str(field.name()), ogr.OFTReal if field.type() == QVariant.Double else ogr.OFTString))
+        
+        featureDefn = ogrLayer.GetLayerDefn()
+        ogrLayer.StartTransaction()
+        try:
+            for feature in self._features():
+                ogrFeature = ogr.Feature(featureDefn)
+                for i, value in enumerate(feature.attributes()):
+                    if value != None:
+                        ogrFeature.SetField(i, value.encode("utf-8") if isinstance(value, unicode) else value)
+                geo = feature.geometry()
+                if geo:
+                    ogrFeature.SetGeometry(ogr.CreateGeometryFromWkt(str(geo.exportToWkt())))
+                ogrLayer.CreateFeature(ogrFeature)
+            ogrLayer.CommitTransaction()
+        except:
+            ogrLayer.RollbackTransaction()
+            ogrLayer = dataSource = None #Cerrar el fichero para poder borrarlo
+            raise
+        
+        for column in ["foi", "Time"]:
+            dataSource.ExecuteSQL('CREATE INDEX "{0}_{1}_idx" ON "{0}" ("{1}")'.format(tableName, column))
+        dataSource = None #Forzar escritura a disco
+        
+        return QgsVectorLayer(fileName + "|layername=" + tableName, self.name, "ogr")
 
     def _toVectorLayer_geojson (self):        
         crs = QgsCoordinateReferenceSystem()
         crs.createFromUserInput(self.provider.srsName)
         
         fileName = self.xmlFile.replace(".xml", ".geojson")
+        self._fileName = fileName
         fields = QgsFields ()
         map (fields.append, self.provider.fields)
         writer = QgsVectorFileWriter (fileName, "utf-8", fields, QGis.WKBPoint, crs, "GeoJSON")
@@ -693,34 +1492,37 @@ class ObservationsLayer (QObject):
         if writer.hasError() != QgsVectorFileWriter.NoError:
             raise Exception (writer.errorMessage())
         
-        for feature in self.provider.getFeatures():
-            self.features.append(feature)
-            writer.addFeature(feature)
-        
-        del writer #Forzar escritura a disco
+        try:
+            for feature in self._features():
+                writer.addFeature(feature)
+        finally:
+            del writer #Forzar escritura a disco
         
         return QgsVectorLayer( fileName, self.name, "ogr")
     
-#     def toVectorLayer_memory (self):
-#         def qgsSrsName (srsName = ""):
-#             import re
-#             m = re.match (".*(EPSG:[0-9]+)$",srsName)
-#             return m.groups()[-1] if m else ""
-#         
-#         path = ("Point?type=SOS&crs={srs!s}&field=").format(srs=qgsSrsName(self.provider.srsName))
-#         path += "&field=".join (map (lambda f: (str(f.name()) + ":") + ("double" if f.type() == QVariant.Double else "string"), self.provider.fields))
-#         path += "&index=yes"
-#         
-#         for feature in self.provider.getFeatures():
-#             self.features.append(feature)
-#         
-#         layer = QgsVectorLayer (path, self._name, "memory")
-#         layerProvider = layer.dataProvider()
-#         layer.startEditing()
-#         layerProvider.addFeatures (self.features)
-#         layer.commitChanges()
-#         
-#         return layer
+    def _toVectorLayer_memory (self):
+        crs = QgsCoordinateReferenceSystem()
+        crs.createFromUserInput(self.provider.srsName)
+        
+        layer = QgsVectorLayer ("Point", self.name, "memory")
+        layer.setCrs (crs)
+        layerProvider = layer.dataProvider()
+        layerProvider.addAttributes (self.provider.fields)
+        layer.updateFields()
+        
+        features = []
+        for feature in self._features():
+            features.append(feature)
+            if len(features) >= self.batchSize:
+                layerProvider.addFeatures (features)
+                features = []
+        if len(features):
+            layerProvider.addFeatures (features)
+        
+        layerProvider.createSpatialIndex()
+        layer.updateExtents()
+        
+        return layer
 
     def __str__(self):
         return self.provider.getObservation()
@@ -4,13 +4,14 @@
  All classes to parse SOS or O&M XML data
 """
 
-from PyQt4.QtCore import QVariant, Qt, QDateTime
+from PyQt4.QtCore import QVariant, Qt, QDateTime, QIODevice, QByteArray, QXmlStreamReader, QXmlStreamWriter
 from xmlparser import * #@UnusedWildImport
 from gmlparser import * #@UnusedWildImport
 from itertools import chain
+from operator import methodcaller
 from qgis.core import QgsOgcUtils as GMLParser, QgsRectangle, QgsField, QgsCoordinateReferenceSystem, QgsPoint, QgsGeometry
 import sos
-from qgstime import QgsTime
+from qgstime import QgsTime, parseTimeKey
 
 
 __all__ = ['XMLParserFactory',
@@ -20,7 +21,9 @@ __all__ = ['XMLParserFactory',
            'SOSObservationOfferingParser',
            'SOSOperationMetadataParser',
            'SOSFilterCapabilitiesParser',
-           'SOSObservationsParser']
+           'SOSObservationsParser',
+           'SOSObservationsStreamParser',
+           'epochMSecs']
 
 class SOSCapabilitiesParser (XMLParser):
     def __init__(self):
@@ -55,10 +58,9 @@ class SOSCapabilitiesParser (XMLParser):
                     self.capabilities.filterCapabilities = XMLParserFactory.getInstance ("SOSFilterCapabilities")().parse(fcNode)
             elif value == "contents":
                 contentsNode, _ = self.searchFirst(node, "Contents")
-                ooParser = XMLParserFactory.getInstance ("SOSObservationOffering")
                 for ooNode, _ in self.search (contentsNode, "offering/ObservationOffering"):
                     _, ooId = self.searchFirst(ooNode, "identifier")
-                    self.capabilities.observationOfferingList[str(ooId)] = ooParser().parse(ooNode)
+                    self.capabilities.observationOfferingList.addNode(str(ooId), ooNode)
         return self.capabilities
 
 class SOSServiceIdentificationParser (XMLParser):
@@ -196,20 +198,47 @@ class SOSFilterCapabilitiesParser (XMLParser):
         return self.capabilities
     
 class SOSObservationsParser (XMLParser):
-    def __init__(self):
-        self.provider = sos.SOSProvider()
+    def __init__(self, provider = None):
+        """
+        :param provider: Observations are added to provider, a new one if None
+        :type provider: SOSProvider
+        """
+        self.provider = provider if provider else sos.SOSProvider()
         
     def parse (self, xml):
         xml = XMLParser.parse(self, xml)
         node,_ = self.searchFirst (xml, "")        
         if not node or not node.localName() == "ObservationCollection":
-            if node.localName() == "ExceptionReport":
-                node, exceptionCode = self.searchFirst(node, "Exception@exceptionCode")
-                _, exceptionText = self.searchFirst(node, "ExceptionText")
-                raise sos.ExceptionReport (exceptionCode, exceptionText)
-            raise ValueError (node.localName())
+            self._raiseException(node)
         
         boundedByNode, boundedByType = self.searchFirst (xml, "boundedBy/*")
+        yx = self._parseBoundedBy(boundedByNode, boundedByType)
+        
+        _, tag = self.searchFirst(xml, 'member/*')
+        omParser = XMLParserFactory.getInstance(tag)(self.provider, yx)
+        
+        components = omParser.parse(xml) 
+        self._setFields(components)
+           
+        return self.provider
+    
+    def _raiseException (self, node):
+        """
+        :param node: Root node of a document which is not an ObservationCollection
+        :type node: QDomNode
+        :raise: ExceptionReport, ValueError
+        """
+        if node.localName() == "ExceptionReport":
+            node, exceptionCode = self.searchFirst(node, "Exception@exceptionCode")
+            _, exceptionText = self.searchFirst(node, "ExceptionText")
+            raise sos.ExceptionReport (exceptionCode, exceptionText)
+        raise ValueError (node.localName())
+    
+    def _parseBoundedBy (self, boundedByNode, boundedByType):
+        """
+        Set provider srsName and extent
+        :return: True if srsName axis are inverted
+        """
         _, self.provider.srsName = self.searchFirst (boundedByNode, "@srsName")
         crs = QgsCoordinateReferenceSystem()
         if crs.createFromUserInput(self.provider.srsName):
@@ -217,155 +246,372 @@ class SOSObservationsParser (XMLParser):
         else:
             yx = (self.provider.srsName == 'urn:ogc:def:crs:EPSG:0') #Hack para meteogalicia
             
+        extent = None
         if boundedByType == "Envelope":
-            self.provider.extent = GMLParser.rectangleFromGMLEnvelope(boundedByNode)
+            extent = GMLParser.rectangleFromGMLEnvelope(boundedByNode)
         elif boundedByType == "Box":
-            self.provider.extent = GMLParser.rectangleFromGMLBox(boundedByNode)
+            extent = GMLParser.rectangleFromGMLBox(boundedByNode)
         else:
             geo = GMLParser.geometryFromGML(boundedByNode)
             if geo:                
-                self.provider.extent = geo.boundingBox()
-        
-        _, tag = self.searchFirst(xml, 'member/*')
-        omParser = XMLParserFactory.getInstance(tag)(self.provider, yx)
-        
-        components = omParser.parse(xml) 
-                                    
+                extent = geo.boundingBox()
+        if extent:
+            #Varios documentos en el mismo provider
+            if self.provider.extent.isEmpty():
+                self.provider.extent = extent
+            else:
+                self.provider.extent.combineExtentWith(extent)
+        return yx
+    
+    def _setFields (self, components):
+        """
+        Set provider fields from observed components, Time first.
+        Fields already in provider are kept.
+        """
         components = filter(lambda f: f != None, components.values())
-        hasTime = False
+        hasTime = len(self.provider.fields) > 2
         for i, f in enumerate(components):
             if f.name() == "Time" or f.name() == "SamplingTime":
                 components.pop (i)
                 f.setName("Time")
-                self.provider.fields.append(f)
+                if not hasTime:
+                    self.provider.fields.append(f)
                 hasTime = True
                 break
         if not hasTime:
             self.provider.fields.append(QgsField ("Time", QVariant.String, ''))
-        self.provider.fields.extend(components)
-           
+        names = [f.name() for f in self.provider.fields]
+        self.provider.fields.extend([f for f in components if not f.name() in names])
+
+class SOSObservationsStreamParser (SOSObservationsParser):
+    """
+    Observations parser that reads the document with a QXmlStreamReader.
+    Only one member is loaded as QDomDocument at a time, so memory usage
+    doesn't depend on the response size.
+    Data can be read from a QIODevice with parse or added in chunks with addData.
+    """
+    def __init__(self, provider = None):
+        super (SOSObservationsStreamParser, self).__init__(provider)
+        self.reader = QXmlStreamReader()
+        self.components = {}
+        self._yx = False
+        self._omParser = None
+        self._depth = 0
+        self._namespaces = []
+        self._buffer = None
+        self._writer = None
+        self._copyDepth = 0
+        
+    def parse (self, xml):
+        """
+        :param xml: XML to parse
+        :type xml: QIODevice or str
+        :return: SOSProvider
+        """
+        if isinstance (xml, QIODevice):
+            if not xml.isOpen() and not xml.open(QIODevice.ReadOnly):
+                raise IOError (xml.errorString())
+            self.reader.setDevice(xml)
+        else:
+            self.reader.addData(xml)
+        self._read()
+        return self.finish()
+    
+    def addData (self, data):
+        """
+        Parse a new chunk of data. Members completed are stored at provider.
+        :param data: XML chunk
+        :type data: QByteArray or str
+        """
+        self.reader.addData(data)
+        self._read()
+        
+    def finish (self):
+        """
+        Must be called when there isn't more data to add
+        :return: SOSProvider
+        """
+        if self.reader.hasError() or self._depth > 0:
+            raise ValueError ("{} in line {}, column {}".format(self.reader.errorString(), self.reader.lineNumber(), self.reader.columnNumber()))
+        if not self._omParser:
+            raise ValueError ("ObservationCollection without members")
+        self._setFields(self.components)
         return self.provider
     
+    def _read (self):
+        reader = self.reader
+        while not reader.atEnd():
+            token = reader.readNext()
+            if token == QXmlStreamReader.StartElement:
+                self._depth += 1
+                if self._writer:
+                    self._writer.writeCurrentToken(reader)
+                elif self._depth == 1:
+                    self._namespaces = reader.namespaceDeclarations()
+                    if reader.name() != "ObservationCollection":
+                        self._startCopy()
+                elif self._depth == 2 and reader.name() in ["boundedBy", "member"]:
+                    self._startCopy()
+            elif token == QXmlStreamReader.EndElement:
+                self._depth -= 1
+                if self._writer:
+                    self._writer.writeCurrentToken(reader)
+                    if self._depth < self._copyDepth:
+                        self._endCopy()
+            elif self._writer and token in [QXmlStreamReader.Characters, QXmlStreamReader.EntityReference]:
+                self._writer.writeCurrentToken(reader)
+                
+        if reader.hasError() and reader.error() != QXmlStreamReader.PrematureEndOfDocumentError:
+            raise ValueError ("{} in line {}, column {}".format(reader.errorString(), reader.lineNumber(), reader.columnNumber()))
+    
+    def _startCopy (self):
+        """
+        Start to copy current element into a new standalone XML document
+        """
+        self._buffer = QByteArray()
+        self._writer = QXmlStreamWriter(self._buffer)
+        self._copyDepth = self._depth
+        #Namespaces declared at root element
+        prefixes = [ns.prefix() for ns in self.reader.namespaceDeclarations()]
+        for ns in self._namespaces:
+            if ns.prefix() in prefixes:
+                continue
+            if ns.prefix():
+                self._writer.writeNamespace(ns.namespaceUri(), ns.prefix())
+            else:
+                self._writer.writeDefaultNamespace(ns.namespaceUri())
+        self._writer.writeCurrentToken(self.reader)
+    
+    def _endCopy (self):
+        """
+        Parse copied element
+        """
+        self._writer = None
+        xml = XMLParser.parse(self, self._buffer)
+        self._buffer = None
+        
+        if self._copyDepth == 1:
+            self._raiseException(xml)
+        elif xml.localName() == "boundedBy":
+            boundedByNode, boundedByType = self.searchFirst (xml, "*")
+            self._yx = self._parseBoundedBy(boundedByNode, boundedByType)
+        elif xml.localName() == "member":
+            if not self._omParser:
+                _, tag = self.searchFirst(xml, '*')
+                self._omParser = XMLParserFactory.getInstance(tag)(self.provider, self._yx)
+            self._omParser.parseMember(xml, self.components)
+    
+def decodeTextBlock (values, blockSeparator, tokenSeparator, columnsCount):
+    """
+    Split SWE TextBlock encoded values into columns
+    :param values: Encoded values
+    :type values: str
+    :param blockSeparator: Block (row) separator
+    :type blockSeparator: str
+    :param tokenSeparator: Token (column) separator
+    :type tokenSeparator: str
+    :param columnsCount: Number of tokens by block
+    :type columnsCount: int
+    :return: list of columns, each one a list of str
+    """
+    values = values.strip()
+    #Whole separators, strip would remove any of their characters
+    while len(blockSeparator) and values.startswith(blockSeparator):
+        values = values[len(blockSeparator):]
+    while len(blockSeparator) and values.endswith(blockSeparator):
+        values = values[:-len(blockSeparator)]
+    if not len(values):
+        return [[] for _ in range(columnsCount)]
+    
+    blocks = values.split(blockSeparator)
+    if blockSeparator != tokenSeparator:
+        #Every block is checked, irregular blocks can compensate each other in the total
+        if set(map(methodcaller("count", tokenSeparator), blocks)) == set([columnsCount - 1]):
+            #All tokens split at once, columns are strided slices
+            tokens = values.replace(blockSeparator, tokenSeparator).split(tokenSeparator)
+            return [tokens[i::columnsCount] for i in range(columnsCount)]
+    else:
+        #Without a block separator of its own only the last row can be incomplete
+        blocks += [""] * (-len(blocks) % columnsCount)
+        return [blocks[i::columnsCount] for i in range(columnsCount)]
+    
+    #Empty or irregular blocks, missing tokens as empty strings
+    rows = [(block.split(tokenSeparator) + [""] * columnsCount)[:columnsCount] for block in blocks if len(block)]
+    return map(list, zip(*rows)) if len(rows) else [[] for _ in range(columnsCount)]
+
+def epochMSecs (time):
+    """
+    :param time: Observation time
+    :type time: QDateTime
+    :return: Time as epoch milliseconds, as stored by SOSProvider. None if time isn't valid
+    :rtype: long
+    """
+    return time.toMSecsSinceEpoch() if time.isValid() else None
+
+class TimeTable (dict):
+    """
+    Intern table of observation times by text. Observations of a document
+    share a few distinct times, each one is parsed once to epoch milliseconds.
+    """
+    def __init__(self, convert = parseTimeKey):
+        """
+        :param convert: Parse a time text
+        :type convert: function
+        """
+        super (TimeTable, self).__init__()
+        self._convert = convert
+    
+    def __missing__ (self, text):
+        time = self[text] = self._convert(text)
+        return time
+
 class ObservationParser (XMLParser):
     def __init__(self, provider, axisInverted):
         self.provider = provider
         self.yx = axisInverted
-        self.timeParser = XMLParserFactory.getInstance ("GMLTime")()
+        #Una instancia por documento, la tabla dura lo que el análisis
+        self.times = TimeTable()
 
     def parse (self, xml):
-        def _float (value):
-            try: return float(value)
-            except: return None
-        
         components = {}
         for member, _ in self.search(xml, "member"):
-            for node, tag in self.search (member, "Observation/*"):
-                if tag == "samplingTime":
-                    samplingTime = self.timeParser.parse(node)
-                elif tag == "observedProperty":
-                    _, prop = self.searchFirst(node, "@href")
-                    if prop:
+            self.parseMember(member, components)
+        return components
+    
+    def parseMember (self, member, components):
+        """
+        :param member: member node
+        :type member: QDomNode
+        :param components: Observed properties fields found, updated with member ones
+        :type components: dict
+        """
+        for node, tag in self.search (member, "Observation/*"):
+            if tag == "observedProperty":
+                _, prop = self.searchFirst(node, "@href")
+                if prop:
+                    if not prop in components: components[prop] = None
+                else:
+                    for _, prop in self.search (node, "CompositePhenomenon/component@href"):
                         if not prop in components: components[prop] = None
-                    else:
-                        for _, prop in self.search (node, "CompositePhenomenon/component@href"):
-                            if not prop in components: components[prop] = None
-                elif tag == "featureOfInterest":
-                    hasSamplingPoint = False
-                    for point, foi_id in chain(self.search (node, "FeatureCollection/featureMember/SamplingPoint@id"),self.search (node, "SamplingPoint@id"),self.search (node, "SamplingPointAtDepth@id")):
-                        hasSamplingPoint = True
-                        _, name = self.searchFirst (point, "name")
-                        pointGeo, _ = self.searchFirst(point, "position")
-                        pointGeo = GMLParser.geometryFromGML(pointGeo)
-                        if self.yx:
-                            pointGeo = pointGeo.asPoint()
-                            pointGeo = QgsGeometry.fromPoint(QgsPoint (pointGeo.y(),pointGeo.x()))
-                        self.provider.features [foi_id] = (name, pointGeo)
-                        if point.localName () == "SamplingPointAtDepth":
-                            _, depth = self.searchFirst (point, "depth")
-                            foi_id = (foi_id, depth)
-                    if not hasSamplingPoint:
-                        for _, foi_id in self.search (node, "FeatureCollection/featureMember@href"):
-                            self.provider.features [foi_id] = (foi_id, None)
-                elif tag == "result":
-                    node, tag = self.searchFirst(node, "*")
-                    if tag == "DataArray":
-                        simpleDataRecord = []
-                        for fieldNode, field in chain(self.search(node, "elementType/SimpleDataRecord/field@name"),self.search(node, "elementType/DataRecord/field@name")):
-                            simpleDataRecord.append(field)
-                            fieldNode, definition = self.searchFirst(fieldNode, "*/@definition")
-                            if definition in components and components[definition] == None:
-                                if fieldNode.localName () == "Quantity":
-                                    fieldType = QVariant.Double
-                                    _, definition = self.searchFirst (fieldNode, "uom@code")
-                                elif fieldNode.localName () == "Time":
-                                    fieldType = QVariant.String
-                                else:
-                                    fieldType = QVariant.String
-                                components[definition] = QgsField (field, fieldType, definition)
-                        
-                        encoding, _ = self.searchFirst (node, "encoding")
-                        _, blockSeparator = self.searchFirst (encoding, "TextBlock@blockSeparator")
-                        _, tokenSeparator = self.searchFirst (encoding, "TextBlock@tokenSeparator")
-                        _, values = self.searchFirst (node, "values")
+            elif tag == "featureOfInterest":
+                hasSamplingPoint = False
+                for point, foi_id in chain(self.search (node, "FeatureCollection/featureMember/SamplingPoint@id"),self.search (node, "SamplingPoint@id"),self.search (node, "SamplingPointAtDepth@id")):
+                    hasSamplingPoint = True
+                    _, name = self.searchFirst (point, "name")
+                    pointGeo, _ = self.searchFirst(point, "position")
+                    pointGeo = GMLParser.geometryFromGML(pointGeo)
+                    if self.yx:
+                        pointGeo = pointGeo.asPoint()
+                        pointGeo = QgsGeometry.fromPoint(QgsPoint (pointGeo.y(),pointGeo.x()))
+                    self.provider.features [foi_id] = (name, pointGeo)
+                if not hasSamplingPoint:
+                    for _, foi_id in self.search (node, "FeatureCollection/featureMember@href"):
+                        self.provider.features [foi_id] = (foi_id, None)
+            elif tag == "result":
+                node, tag = self.searchFirst(node, "*")
+                if tag == "DataArray":
+                    simpleDataRecord = []
+                    fieldTypes = {}
+                    for fieldNode, field in chain(self.search(node, "elementType/SimpleDataRecord/field@name"),self.search(node, "elementType/DataRecord/field@name")):
+                        simpleDataRecord.append(field)
+                        fieldNode, definition = self.searchFirst(fieldNode, "*/@definition")
+                        fieldTypes[field] = QVariant.Double if fieldNode != None and fieldNode.localName () == "Quantity" else QVariant.String
+                        if definition in components and components[definition] == None:
+                            if fieldNode.localName () == "Quantity":
+                                fieldType = QVariant.Double
+                                _, definition = self.searchFirst (fieldNode, "uom@code")
+                            elif fieldNode.localName () == "Time":
+                                fieldType = QVariant.String
+                            else:
+                                fieldType = QVariant.String
+                            components[definition] = QgsField (field, fieldType, definition)
+                    
+                    encoding, _ = self.searchFirst (node, "encoding")
+                    _, blockSeparator = self.searchFirst (encoding, "TextBlock@blockSeparator")
+                    _, tokenSeparator = self.searchFirst (encoding, "TextBlock@tokenSeparator")
+                    _, values = self.searchFirst (node, "values")
+                    try:
+                        indexes = map(simpleDataRecord.index, ["feature", "Time"])
+                    except:
+                        indexes = None
+                    
+                    if not indexes:
                         try:
-                            indexes = map(simpleDataRecord.index, ["feature", "Time"])
+                            indexes = map(simpleDataRecord.index, ["FeatureOfInterest","SamplingTime"])
                         except:
                             indexes = None
-                        
-                        if not indexes:
-                            try:
-                                indexes = map(simpleDataRecord.index, ["FeatureOfInterest","SamplingTime"])
-                            except:
-                                indexes = None
-                                
-                        if not indexes:
-                            raise ValueError('SimpleDataRecord = ' + str(simpleDataRecord)) 
+                            
+                    if not indexes:
+                        raise ValueError('SimpleDataRecord = ' + str(simpleDataRecord)) 
 
-                        map(simpleDataRecord.pop, indexes)
-                        for block in filter (lambda x: len(x), values.split (blockSeparator)):
-                            observation = block.split(tokenSeparator)
-                            observationKeys = map(observation.pop, indexes)
-                            map (lambda prop, value: self.provider.setObservation (unicode(observationKeys[0]), QDateTime.fromString(observationKeys[1], Qt.ISODate), unicode(prop), str(value)), simpleDataRecord, observation)
-        return components                        
+                    columns = decodeTextBlock (values, blockSeparator, tokenSeparator, len(simpleDataRecord))
+                    #Each distinct feature key is created only once
+                    fois = {f: sos.FeatureOfInterestKey(f) for f in set(columns[indexes[0]])}
+                    foiColumn = map(fois.__getitem__, columns[indexes[0]])
+                    #Each distinct time is parsed only once by document
+                    timeColumn = map(self.times.__getitem__, columns[indexes[1]])
+                    for i, prop in enumerate(simpleDataRecord):
+                        if not i in indexes:
+                            self.provider.setObservations (foiColumn, timeColumn, unicode(prop), map(str, columns[i]), fieldTypes[prop])
         
 class MeasurementParser (XMLParser):
     def __init__(self, provider, axisInverted):
         self.provider = provider
         self.yx = axisInverted
         self.timeParser = XMLParserFactory.getInstance ("GMLTime")()
+        self.times = TimeTable()
 
     def parse (self, xml):
+        components = {}
+        for member, _ in self.search(xml, "member"):
+            self.parseMember(member, components)
+        return components
+    
+    def parseMember (self, member, components):
+        """
+        :param member: member node
+        :type member: QDomNode
+        :param components: Observed properties fields found, updated with member ones
+        :type components: dict
+        """
         def _float (value):
             try: return float(value)
             except: return None
         
-        components = {}
-        for member, _ in self.search(xml, "member"):
-            for node, tag in self.search (member, "Measurement/*"):
-                if tag == "samplingTime":
-                    samplingTime = self.timeParser.parse(node)
-                elif tag == "observedProperty":
-                    _, prop = self.searchFirst(node, "@href")
-                    if not prop in components: components[prop] = None
-                elif tag == "featureOfInterest":
-                    hasSamplingPoint = False
-                    for point, foi_id in chain(self.search (node, "FeatureCollection/featureMember/SamplingPoint@id"),self.search (node, "SamplingPoint@id"),self.search (node, "SamplingPointAtDepth@id")):
-                        hasSamplingPoint = True
-                        _, name = self.searchFirst (point, "name")
-                        pointGeo, _ = self.searchFirst(point, "position")
-                        pointGeo = GMLParser.geometryFromGML(pointGeo)
-                        if self.yx:
-                            pointGeo = pointGeo.asPoint()
-                            pointGeo = QgsGeometry.fromPoint(QgsPoint (pointGeo.y(),pointGeo.x()))
-                        self.provider.features [foi_id] = (name, pointGeo)
-                        if point.localName () == "SamplingPointAtDepth":
-                            _, depth = self.searchFirst (point, "depth")
-                            foi_id = (foi_id, depth)
-                    if not hasSamplingPoint:
-                        for _, foi_id in self.search (node, "FeatureCollection/featureMember@href"):
-                            self.provider.features [foi_id] = (foi_id, None)
-                elif node.localName () == "result":
-                    self.provider.setObservation (unicode(foi_id), QDateTime.fromString(str(samplingTime), Qt.ISODate), unicode(prop), str(tag))
-                    if prop in components and components[prop] == None:
-                        components[prop] = QgsField (prop, QVariant.Double if _float(tag) else QVariant.String, node.attribute("uom"))
-        return components                        
\ No newline at end of file
+        foiKey = samplingTime = prop = None
+        for node, tag in self.search (member, "Measurement/*"):
+            if tag == "samplingTime":
+                _, timePosition = self.searchFirst(node, "TimeInstant/timePosition")
+                if timePosition:
+                    samplingTime = self.times[timePosition]
+                else:
+                    samplingTime = parseTimeKey(str(self.timeParser.parse(node)))
+            elif tag == "observedProperty":
+                _, prop = self.searchFirst(node, "@href")
+                if not prop in components: components[prop] = None
+            elif tag == "featureOfInterest":
+                hasSamplingPoint = False
+                for point, foi_id in chain(self.search (node, "FeatureCollection/featureMember/SamplingPoint@id"),self.search (node, "SamplingPoint@id"),self.search (node, "SamplingPointAtDepth@id")):
+                    hasSamplingPoint = True
+                    _, name = self.searchFirst (point, "name")
+                    pointGeo, _ = self.searchFirst(point, "position")
+                    pointGeo = GMLParser.geometryFromGML(pointGeo)
+                    if self.yx:
+                        pointGeo = pointGeo.asPoint()
+                        pointGeo = QgsGeometry.fromPoint(QgsPoint (pointGeo.y(),pointGeo.x()))
+                    self.provider.features [foi_id] = (name, pointGeo)
+                    foiKey = sos.FeatureOfInterestKey (foi_id)
+                    if point.localName () == "SamplingPointAtDepth":
+                        _, depth = self.searchFirst (point, "depth")
+                        foiKey = sos.FeatureOfInterestKey (foi_id, depth)
+                if not hasSamplingPoint:
+                    for _, foi_id in self.search (node, "FeatureCollection/featureMember@href"):
+                        self.provider.features [foi_id] = (foi_id, None)
+                        foiKey = sos.FeatureOfInterestKey (foi_id)
+            elif node.localName () == "result":
+                if foiKey is None or samplingTime is None or prop is None:
+                    #Medida sin feature of interest, tiempo o propiedad, se omite
+                    continue
+                if prop in components and components[prop] == None:
+                    components[prop] = QgsField (prop, QVariant.Double if _float(tag) != None else QVariant.String, node.attribute("uom"))
+                self.provider.setObservation (foiKey, samplingTime, unicode(prop), str(tag), components[prop].type())
@@ -5,7 +5,7 @@ XMLParser module, includes a xml parser factory and a XML parser abstract base c
 import abc
 from PyQt4.QtXml import QDomDocument, QDomNode, QDomElement
 
-__all__ = ['XMLParserFactory', 'XMLParser']
+__all__ = ['XMLParserFactory', 'XMLParser', 'XMLQuery']
 
 class XMLParserFactory () :
     """
@@ -25,14 +25,67 @@ class XMLParserFactory () :
         """
         if self._parsers == None:
             self._parsers = dict()
-            for cls in XMLParser.__subclasses__():
+            subclasses = XMLParser.__subclasses__()
+            while len(subclasses):
+                cls = subclasses.pop()
                 self._parsers[cls.__name__] = cls
+                subclasses.extend(cls.__subclasses__())
         tagname = preffix + tagname + "Parser"
         try:
             return self._parsers[tagname]
         except KeyError:
             raise NotImplementedError(tagname)
 
+class XMLQuery (object):
+    """
+    Compiled XMLParser search query.
+    Query syntax is "tag/tag/...@attribute=value", all parts are optional.
+    """
+    _cache = {}
+    cacheSize = 256
+    
+    def __init__(self, query):
+        """
+        :param query: Query to compile
+        :type query: str
+        :raise: TypeError
+        """
+        if not isinstance (query, str):
+            raise TypeError ("query must be a string")
+        
+        self.query = query
+        path = query.split("@")[ 0]
+        attr = query.split("@")[-1] if "@" in query else ""
+        self.value = attr.split ("=")[-1] if "=" in attr else ""
+        self.attribute = attr.split ("=")[ 0]
+        self.path = path.split("/")
+        #Siblings of last node are searched by tag name, any element for "*"
+        self.siblingTag = self.path[-1] if self.path[-1] <> "*" else ""
+    
+    @classmethod
+    def compile (cls, query):
+        """
+        Compiled query from a cache of queries, emptied when it's full
+        :param query: Query to compile
+        :type query: str
+        :return: XMLQuery
+        :raise: TypeError
+        """
+        #u"a" == "a", sin esta comprobación unicode tomaría la consulta de str
+        if type(query) is not str:
+            raise TypeError ("query must be a string")
+        try:
+            return cls._cache[query]
+        except KeyError:
+            compiled = cls(query)
+            if len(cls._cache) >= cls.cacheSize:
+                cls._cache.clear()
+            cls._cache[query] = compiled
+            return compiled
+    
+    def __str__ (self):
+        return self.query
+
 class XMLParser (object):
     """
     XML parser base class
@@ -61,7 +114,7 @@ class XMLParser (object):
         :param xml: XML to parse
         :type xml: QDomNode
         :param query: 
-        :type query: str
+        :type query: str or XMLQuery
         :return: QDomNode, str
         """
         for node, value in XMLParser.search (xml, query):
@@ -74,7 +127,7 @@ class XMLParser (object):
         :param xml: XML to parse
         :type xml: QDomNode
         :param query: 
-        :type query: str
+        :type query: str or XMLQuery
         :return: QDomNode, str generator
         """
         def _text (node, attr=None):
@@ -86,15 +139,12 @@ class XMLParser (object):
             
         if not isinstance (xml, QDomNode):
             raise TypeError ("xml must be a QDomNode")
-        if not isinstance (query, str):
-            raise TypeError ("query must be a string")
-
-        tag = query.split("@")[ 0]
-        attr = query.split("@")[-1] if "@" in query else ""
-        val = attr.split ("=")[-1] if "=" in attr else ""
-        attr = attr.split ("=")[ 0]
+        if not isinstance (query, XMLQuery):
+            query = XMLQuery.compile(query)
+        attr = query.attribute
+        val = query.value
 
-        for tag in tag.split("/"):
+        for tag in query.path:
             if   tag == "*": xml = xml.firstChildElement ()         
             elif tag <> "":  xml = xml.firstChildElement (tag)
 
@@ -106,4 +156,4 @@ class XMLParser (object):
                     yield xml, _text(xml)
             else:
                 yield xml, _text(xml)
-            xml = xml.nextSiblingElement (tag if tag <> "*" else "")
+            xml = xml.nextSiblingElement (query.siblingTag)
@@ -21,14 +21,17 @@
  ***************************************************************************/
 """
 
-from PyQt4.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, QFile
+from PyQt4.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, QFile, QUrl
 from PyQt4.QtGui import QMenu, QAction, QIcon, QMessageBox
+from qgis.core import QgsApplication
 from qgis.gui import QgsMessageBar
 from ui import resources_rc #@UnusedImport
 from sos_client_dialog import SOSClientDialog
 from xmlviewer_dialog import XmlViewerDialog
 from xmlhighlighter import XmlHighlighter
 from sosplot_dialog import SOSPlotDialog
+from sos.sos import ObservationsLayer
+from sos.network import RequestQueue
 import os.path
 
 class SOSClient:
@@ -178,6 +181,15 @@ class SOSClient:
             parent=self.iface.mainWindow(),
             add_to_toolbar=True)
         
+        self.refreshAction = self.add_action(
+            QgsApplication.iconPath("mActionDraw.svg"),
+            text=self.tr(u'Refresh layer'),
+            callback=self.refreshLayer,
+            enabled_flag=ObservationsLayer.appendable(self.iface.activeLayer()),
+            parent=self.iface.mainWindow(),
+            status_tip=self.tr(u'Add observations later than those of the layer'))
+        self.iface.currentLayerChanged.connect(self.currentLayerChanged)
+        
         self.add_action(
             ':/plugins/SOSClient/icon_plot.png',
             text=self.tr(u'Plot'),
@@ -197,6 +209,7 @@ class SOSClient:
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
+        self.iface.currentLayerChanged.disconnect(self.currentLayerChanged)
         for action in self.actions:
             self.iface.removeToolBarIcon(action)
         self.iface.webMenu().removeAction(self.menu.menuAction())
@@ -227,6 +240,59 @@ class SOSClient:
         else:
             self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),self.tr("Layer have not a xml property"), QgsMessageBar.WARNING, 10)
             
+    def currentLayerChanged (self, layer):
+        self.refreshAction.setEnabled(ObservationsLayer.appendable(layer))
+    
+    def refreshLayer (self):
+        layer = self.iface.activeLayer()
+        if layer == None:
+            self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),self.tr("You must select a layer"), QgsMessageBar.WARNING, 10)
+            return
+        
+        try:
+            url, requests, lastTime = ObservationsLayer.refreshRequests(layer)
+        except Exception as error:
+            self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),unicode(error), QgsMessageBar.CRITICAL, 10)
+            return
+        if not url:
+            self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),self.tr("Layer have not a SOS request"), QgsMessageBar.WARNING, 10)
+            return
+        if not ObservationsLayer.appendable(layer):
+            self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),self.tr("Features can't be added to layer {}, create it with an editable storage to refresh it").format(layer.name()), QgsMessageBar.WARNING, 10)
+            return
+        
+        settings = QSettings()
+        queue = RequestQueue (settings.value("SOSClient/maxInFlight", 4, type=int), self.iface.mainWindow(),
+                              retries = settings.value("SOSClient/retries", 3, type=int),
+                              backoff = settings.value("SOSClient/retryBackoff", 2.0, type=float))
+        observations = ObservationsLayer (layer.name(), stream = True, storage = ObservationsLayer.Memory)
+        errors = []
+        
+        def requestFinished (key, error):
+            if error:
+                errors.append(error)
+                observations.discardSource(key)
+        
+        def finishRequests ():
+            queue.deleteLater()
+            try:
+                if len(errors) == len(requests):
+                    raise Exception (errors[0])
+                added = observations.appendTo(layer, lastTime)
+                layer.triggerRepaint()
+                if len(errors) or len(observations.sourceErrors):
+                    self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),"; ".join(set(errors + observations.sourceErrors.values())), QgsMessageBar.WARNING, 10)
+                self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),self.tr("{} observations added to {}").format(added, layer.name()), QgsMessageBar.INFO, 5)
+            except Exception as error:
+                self.iface.messageBar().pushMessage (self.tr(u'SOS Client'),unicode(error), QgsMessageBar.CRITICAL, 10)
+        
+        queue.dataReceived.connect (lambda key, data: observations.addData(data, key))
+        queue.requestRetried.connect (observations.discardSource)
+        queue.requestFinished.connect (requestFinished)
+        queue.finished.connect (finishRequests)
+        for key, xml in enumerate(requests):
+            queue.add (key, QUrl(url), xml)
+        
     def showPlotDialog (self):
         try:
             dlg = SOSPlotDialog (self.iface.activeLayer(), parent=self.iface.mainWindow())
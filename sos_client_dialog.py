@@ -27,13 +27,17 @@ from qgis.core import QgsApplication, QgsOWSConnection, QgsNetworkAccessManager,
 from qgis.gui import QgsNewHttpConnection, QgsMessageBar
 from qgis.utils import showPluginHelp
 from sos.sos import SensorObservationService, FilterRequest, ObservationsLayer
+from sos.cache import CapabilitiesCache, ObservationsCache
+from sos.network import RequestQueue, ReplyDecoder, DownloadManifest, ReplyFile, setRequestHeaders
 from utils import WidgetFactory, QStringListCheckableModel, QgsDebug, TimeWidget, TimePeriodWidget, QLineEditButton, addContextMenuActions#, QgsManageConnectionsDialogSOS
 from qgsmaptool_capturespatialoperand import QgsMapToolCaptureSpatialOperand
 from textedit_dialog import TextEditDialog
 from xmlviewer_dialog import XmlViewerDialog
 from xmlhighlighter import XmlHighlighter
 from tempfile import mkstemp
+from datetime import timedelta
 import os
+import shutil
 
 class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')):
     """
@@ -52,6 +56,9 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
                 
         self.iface = iface
         self.reply = None
+        self.pendingLayer = None
+        #Veces que se puede dividir una petición con respuesta demasiado grande
+        self.maxRequestSplits = 3
         self.service = None
         self.filterRequest = None
         self.createTimeManagerLayer = False
@@ -65,6 +72,7 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         # Botón Añadir y Editar y añadir
         self.btnAdd.setDefaultAction (self.actionAdd)
         self.btnAdd.addAction(self.actionEditRequest)
+        self.btnAdd.addAction(self.actionAddOfferings)
         self.btnBox.addButton(self.btnAdd, QtGui.QDialogButtonBox.ActionRole)
         self.btnAdd.setEnabled(False)
         
@@ -99,6 +107,38 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         #Directorio de trabajo
         self.workDirName.setText(settings.value("SOSClient/workDir", QtCore.QDir.tempPath(), type=str))
         self.workDirName.textChanged.connect (lambda value : settings.setValue("SOSClient/workDir", value))
+        
+        #Almacenamiento de la capa
+        self.cmbLayerStorage.addItem (self.tr("GeoJSON file"), ObservationsLayer.GeoJSON)
+        self.cmbLayerStorage.addItem (self.tr("Memory"), ObservationsLayer.Memory)
+        self.cmbLayerStorage.addItem (self.tr("GeoPackage file"), ObservationsLayer.GeoPackage)
+        self.cmbLayerStorage.addItem (self.tr("SpatiaLite file"), ObservationsLayer.SpatiaLite)
+        self.cmbLayerStorage.setCurrentIndex (max(0, self.cmbLayerStorage.findData(settings.value("SOSClient/layerStorage", ObservationsLayer.GeoJSON, type=str))))
+        self.cmbLayerStorage.currentIndexChanged.connect (lambda index : settings.setValue("SOSClient/layerStorage", self.selectedLayerStorage))
+        
+        #Caché de capacidades
+        self.capabilitiesCache = CapabilitiesCache (os.path.join(QgsApplication.qgisSettingsDirPath(), "SOSClient", "capabilities"),
+                                                    maxSize = settings.value("SOSClient/capabilitiesCacheSize", 50, type=int) * 1024 * 1024,
+                                                    ttl = settings.value("SOSClient/capabilitiesCacheTTL", 3600, type=int))
+        
+        #Caché de observaciones
+        self.observationsCache = ObservationsCache (os.path.join(QgsApplication.qgisSettingsDirPath(), "SOSClient", "observations"),
+                                                    maxSize = settings.value("SOSClient/observationsCacheSize", 200, type=int) * 1024 * 1024,
+                                                    ttl = settings.value("SOSClient/observationsCacheTTL", 86400, type=int))
+        
+        #Dividir el filtro temporal
+        self.spnTemporalWindow.setValue (settings.value("SOSClient/temporalWindow", 0, type=int))
+        self.spnTemporalWindow.valueChanged.connect (lambda value : settings.setValue("SOSClient/temporalWindow", value))
+        
+        #Dividir la extensión en teselas
+        self.spnSpatialTiles.setValue (settings.value("SOSClient/spatialTiles", 1, type=int))
+        self.spnSpatialTiles.valueChanged.connect (lambda value : settings.setValue("SOSClient/spatialTiles", value))
+        self.spnMaxReplySize.setValue (settings.value("SOSClient/maxReplySize", 0, type=int))
+        self.spnMaxReplySize.valueChanged.connect (lambda value : settings.setValue("SOSClient/maxReplySize", value))
+        
+        #Guardar la respuesta XML
+        self.chkKeepReply.setChecked (settings.value("SOSClient/keepReply", True, type=bool))
+        self.chkKeepReply.toggled.connect (lambda checked : settings.setValue("SOSClient/keepReply", checked))
     
     @property
     def selectedOffering (self):
@@ -126,6 +166,11 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         try: return self.cmbResultModel.currentText()
         except: return ""
         
+    @property
+    def selectedLayerStorage (self):
+        try: return self.cmbLayerStorage.itemData(self.cmbLayerStorage.currentIndex())
+        except: return ObservationsLayer.GeoJSON
+        
     @property
     def selectedWorkDir (self):
         try: return self.workDirName.text
@@ -170,7 +215,14 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         QgsMessageLog.logMessage(self.tr("Connecting to {url}").format(url=url), "SosClient", QgsMessageLog.INFO)
         
         if url != "" :
-            self.executeRequest(SensorObservationService.capabilitiesUrl(url), self.capabilitiesRequest)
+            url = SensorObservationService.capabilitiesUrl(url)
+            key = unicode(url.toString())
+            if self.capabilitiesCache.fresh(key):
+                self.messageBar.clearWidgets()
+                self.capabilitiesCache.get(key)
+                self.capabilitiesRequest(self.capabilitiesCache.fileName(key), url)
+            else:
+                self.executeRequest(url, self.capabilitiesRequest, headers = self.capabilitiesCache.validators(key))
 
     @QtCore.pyqtSlot()
     def on_btnNew_clicked(self):
@@ -243,17 +295,34 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
             self.messageBar.pushMessage(self.lblSpatialFilterWarning.text(),QgsMessageBar.WARNING,10)
         self.lblSpatialFilterWarning.setVisible (len(self.selectedFeaturesOfInterest) > 0)
     
-    def executeRequest (self, url, callback, post = None):
+    def executeRequest (self, url, callback, post = None, dataReceived = None, saveReply = True, headers = {}):
+        """
+        :param callback: Called with reply filename when request finishes without error
+        :param headers: Raw request headers
+        :param dataReceived: Called with every chunk of the reply as it's downloaded
+        :param saveReply: Keep the reply file. If False callback receives a
+        filename in work dir that doesn't exist
+        
+        Replies are written to a file in work dir while they're downloaded. If
+        the request fails the partial reply is kept with a DownloadManifest and
+        the next identical request resumes it.
+        """
         self.messageBar.clearWidgets()
         self.cmbOfferings.setEnabled (False)
         self.tabWidget.setEnabled (False)
         
+        #Reanudar la descarga interrumpida de la misma petición
+        manifest = DownloadManifest(self.selectedWorkDir(), unicode(url.toString()), [post])
+        resume = manifest.resumable
+        
+        request = QNetworkRequest(url)
+        setRequestHeaders(request, dict(headers, **manifest.rangeHeaders()) if resume else headers)
         if post:
-            request = QNetworkRequest(url)
             request.setRawHeader('Content-Type', 'application/xml')
             self.reply = QgsNetworkAccessManager.instance().post(request,post)
         else:
-            self.reply = QgsNetworkAccessManager.instance().get(QNetworkRequest(url))
+            self.reply = QgsNetworkAccessManager.instance().get(request)
+        decoder = ReplyDecoder(self.reply)
             
         progressMessageBar = self.messageBar.createMessage(self.tr("Please wait while downloading"))
         progressBar = QtGui.QProgressBar(self)
@@ -274,21 +343,57 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         btnAbort.clicked.connect(self.reply.abort)
         progressMessageBar.layout().addWidget(btnAbort)
         
-        fd, replyFilename = mkstemp(suffix=".xml", prefix = callback.__name__, dir = self.selectedWorkDir())
-        os.close(fd)
-        replyFile = open (replyFilename, "w")
+        if resume:
+            replyFilename = manifest.replyFileName
+        else:
+            fd, replyFilename = mkstemp(suffix=".xml", prefix = callback.__name__, dir = self.selectedWorkDir())
+            os.close(fd)
+        #La respuesta se guarda siempre para poder reanudarla, se abre con
+        #los primeros datos, cuando se sabe si continúa la respuesta parcial
+        replyFile = ReplyFile (replyFilename, manifest, resume)
+        
+        def openReplyFile ():
+            if replyFile.open (self.reply):
+                QgsMessageLog.logMessage(self.tr("Resuming download at {size} bytes").format(size=manifest.size), "SosClient", QgsMessageLog.INFO)
+                if dataReceived:
+                    self.readChunks (replyFilename, dataReceived)
+        
+        def writeData (data):
+            if len(data):
+                try:
+                    openReplyFile()
+                    replyFile.write (self.reply, data)
+                except: pass
+                if dataReceived:
+                    dataReceived (data)
         
         def replyReadyRead ():
-            try: replyFile.write (self.reply.readAll())
-            except: pass
+            writeData (decoder.read())
+            if decoder.error and self.reply.isRunning():
+                self.reply.abort()
         self.reply.readyRead.connect(replyReadyRead)
         
         def finishRequest ():
-            replyFile.close()
+            if self.reply.bytesAvailable():
+                replyReadyRead()
+            failed = self.reply.error() != QNetworkReply.NoError or bool(decoder.error)
+            if not failed:
+                writeData (decoder.flush())
+                #Respuesta vacía
+                openReplyFile()
+            #Solo se reanudan respuestas correctas interrumpidas, no páginas de error
+            if replyFile.finish (self.reply, failed,
+                                 resumable = self.reply.error() != QNetworkReply.NoError and not decoder.error and \
+                                             self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) in [200, 206],
+                                 keepFile = saveReply):
+                QgsMessageLog.logMessage(self.tr("Partial reply kept at {file}, repeat the request to resume it").format(file=replyFilename), "SosClient", QgsMessageLog.INFO)
             self.cmbOfferings.setEnabled (True)
             self.tabWidget.setEnabled(True)
             self.messageBar.clearWidgets()
-            if self.reply.error() != QNetworkReply.NoError:
+            self.logTransfer (decoder.wireBytes, decoder.decodedBytes)
+            if decoder.error:
+                self.messageBar.pushMessage(decoder.error, QgsMessageBar.CRITICAL)
+            elif self.reply.error() != QNetworkReply.NoError:
                 self.messageBar.pushMessage(self.reply.errorString(), QgsMessageBar.CRITICAL)
             else:
                 callback(replyFilename)
@@ -297,10 +402,27 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
         
         self.messageBar.pushWidget(progressMessageBar, QgsMessageBar.INFO)
         
-    def capabilitiesRequest (self, fileName):
+    def capabilitiesRequest (self, fileName, url = None):
+        """
+        :param fileName: GetCapabilities reply, empty if server replied 304 Not Modified
+        :param url: GetCapabilities URL if reply was read from cache instead of self.reply
+        """
         try:
-            self.service = SensorObservationService (self.reply.url(), fileName)
+            cached = url != None
+            if not cached:
+                url = self.reply.request().url()
+                key = unicode(url.toString())
+                if self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 304 and key in self.capabilitiesCache:
+                    os.remove(fileName)
+                    self.capabilitiesCache.revalidated(key)
+                    fileName = self.capabilitiesCache.fileName(key)
+                    cached = True
+            self.service = SensorObservationService (url, fileName, self.capabilitiesCache.snapshotFileName(unicode(url.toString())))
             self.filterRequest = FilterRequest (self.service)
+            if not cached:
+                self.capabilitiesCache.put(key, fileName,
+                                           etag = str(self.reply.rawHeader("ETag")),
+                                           lastModified = str(self.reply.rawHeader("Last-Modified")))
         except Exception as error:
             self.service = None
             widget = self.messageBar.createMessage(unicode(error))
@@ -314,7 +436,7 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
             self.messageBar.pushMessage(self.tr("Capabilities downloaded"),QgsMessageBar.INFO,3)
             self.htmlView.setText (unicode(self.service))
             for offer in self.service.observationOfferingList:
-                    self.cmbOfferings.addItem("%s (%s)" % (self.service[offer].identifier,self.service[offer].identifier), self.service[offer].identifier)
+                    self.cmbOfferings.addItem("%s (%s)" % (offer, offer), offer)
                     
             index = self.cmbOfferings.currentIndex()
             if index > -1: self.cmbOfferings.activated.emit(index)
@@ -528,14 +650,11 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
     @QtCore.pyqtSlot()
     def on_actionAdd_triggered(self):
         if self.service:
-            self.executeRequest(self.service.getObservationsUrl,
-                                self.observationsRequest,
-                                self.service.getObservations(offering = self.selectedOffering,
-                                                             properties = self.selectedProperties,
-                                                             features = self.selectedFeaturesOfInterest,
-                                                             procedures = self.selectedProcedures,
-                                                             filters = self.filterRequest,
-                                                             resultModel = self.selectedResultModel))
+            requests = self.observationsRequests([self.selectedOffering])
+            if len(requests) > 1:
+                self.requestObservationsBatch(requests)
+            else:
+                self.requestObservations(self.getObservationsXml(self.selectedOffering, self.filterRequest))
         
     @QtCore.pyqtSlot()
     def on_actionEditRequest_triggered(self):
@@ -549,27 +668,298 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
                                                                resultModel = self.selectedResultModel),
                                   XmlHighlighter)
             if dlg.exec_():
-                self.executeRequest(self.service.getObservationsUrl, self.observationsRequest, dlg.text)
+                self.requestObservations(dlg.text)
+    
+    @QtCore.pyqtSlot()
+    def on_actionAddOfferings_triggered(self):
+        if self.service:
+            requests = self.observationsRequests(self.selectOfferings())
+            if len(requests):
+                self.requestObservationsBatch(requests)
+    
+    def getObservationsXml (self, offer, filters):
+        """
+        GetObservation of selected properties, features and procedures of offer
+        """
+        observableProperties = self.service[offer].observableProperties
+        return self.service.getObservations(offering = offer,
+                                            properties = [p for p in self.selectedProperties if p in observableProperties],
+                                            features = self.selectedFeaturesOfInterest,
+                                            procedures = self.selectedProcedures if offer == self.selectedOffering else [],
+                                            filters = filters,
+                                            resultModel = self.selectedResultModel)
+    
+    def observationsRequests (self, offerings):
+        """
+        Filter request split by time window and spatial tile, see
+        FilterRequest.temporalWindows and FilterRequest.spatialTiles
+        :return: Key, offering and filter by request
+        :rtype: (tuple, str, FilterRequest) list
+        """
+        days = self.spnTemporalWindow.value()
+        windows = self.filterRequest.temporalWindows(timedelta(days = days)) if days > 0 else [self.filterRequest]
+        requests = []
+        for offer in offerings:
+            for i, window in enumerate(windows):
+                #Con lista de features no se envía filtro espacial
+                tiles = [window] if len(self.selectedFeaturesOfInterest) else window.spatialTiles(self.spnSpatialTiles.value(), extent = self.service[offer].observedArea)
+                for j, tile in enumerate(tiles):
+                    requests.append (((offer, i, j), offer, tile))
+        return requests
+    
+    def selectOfferings (self):
+        """
+        :return: Offerings checked by user among those observing any selected property
+        """
+        properties = set(self.selectedProperties)
+        offerings = [offer for offer in self.service.observationOfferingList
+                     if not len(properties) or len(properties.intersection(self.service[offer].observableProperties))]
+        
+        dlg = QtGui.QDialog(self)
+        dlg.setWindowTitle(self.tr("Offerings"))
+        layout = QtGui.QVBoxLayout(dlg)
+        model = QStringListCheckableModel(offerings, [self.selectedOffering])
+        view = QtGui.QListView(dlg)
+        view.setModel(model)
+        layout.addWidget(view)
+        buttons = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel, parent = dlg)
+        buttons.accepted.connect(dlg.accept)
+        buttons.rejected.connect(dlg.reject)
+        layout.addWidget(buttons)
+        
+        return model.stringListChecked if dlg.exec_() else []
+    
+    def requestObservationsBatch (self, requests):
+        """
+        Send several GetObservation requests concurrently, failed ones are
+        retried. Replies are parsed while they're downloaded and merged in one layer.
+        Requests whose reply exceeds the maximum size are split in spatial tiles.
+        Replies of completed requests are kept until the whole batch succeeds,
+        so a failed batch is resumed after the last completed request.
+        Requests found in the observations cache aren't sent.
+        :param requests: Key, offering and filter by request
+        :type requests: (tuple, str, FilterRequest) list
+        """
+        layer = self.newObservationsLayer()
+        #Nombre base de los ficheros de la capa
+        fd, fileName = mkstemp(suffix=".xml", prefix = "observationsRequest", dir = self.selectedWorkDir())
+        os.close(fd)
+        os.remove(fileName)
+        url = self.service.getObservationsUrl
+        layer.requestUrl = unicode(url.toString())
+        layer.requests = [self.getObservationsXml(offer, filters) for _, offer, filters in requests]
+        layer.afterFilter = "TM_After" in self.service.temporalOperators
+        manifest = DownloadManifest(self.selectedWorkDir(), layer.requestUrl, layer.requests)
+        chunkFileNames = {}
+        chunkFiles = {}
+        
+        self.messageBar.clearWidgets()
+        self.cmbOfferings.setEnabled (False)
+        self.tabWidget.setEnabled (False)
+        
+        settings = QtCore.QSettings()
+        queue = RequestQueue (settings.value("SOSClient/maxInFlight", 4, type=int), self,
+                              retries = settings.value("SOSClient/retries", 3, type=int),
+                              backoff = settings.value("SOSClient/retryBackoff", 2.0, type=float))
+        maxReplySize = self.spnMaxReplySize.value() * 1024 * 1024
+        
+        progressMessageBar = self.messageBar.createMessage(self.tr("Please wait while downloading"))
+        progressBar = QtGui.QProgressBar(self)
+        progressBar.setRange(0, len(requests))
+        progressBar.setValue(0)
+        progressBar.setFormat(self.tr("%v of %m requests"))
+        progressBar.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter)
+        progressMessageBar.layout().addWidget(progressBar)
+        
+        btnAbort = QtGui.QPushButton(self.tr("Abort"))
+        btnAbort.clicked.connect(queue.abort)
+        progressMessageBar.layout().addWidget(btnAbort)
+        
+        succeeded = []
+        errors = []
+        def requestFinished (key, error):
+            if error:
+                errors.append(error)
+                #La capa no incluye observaciones parciales de la petición
+                discardChunk(key)
+                layer.discardSource(key)
+            else:
+                succeeded.append(key)
+                if key in chunkFiles:
+                    chunkFiles.pop(key).close()
+                    manifest.addChunk(requestsByKey[key][3], chunkFileNames[key])
+                    if not key in layer.sourceErrors:
+                        self.observationsCache.put(cacheKeys[key], chunkFileNames[key])
+        
+        def dataReceived (key, data):
+            if key not in chunkFiles:
+                chunkFiles[key] = open (chunkFileNames[key], "w")
+            chunkFiles[key].write(data)
+            layer.addData(data, key)
+        
+        def discardChunk (key):
+            if key in chunkFiles:
+                chunkFiles.pop(key).close()
+                os.remove(chunkFileNames[key])
+        
+        def requestRetried (key):
+            #El reintento puede devolver otras observaciones, se descartan las del intento abortado
+            discardChunk(key)
+            layer.discardSource(key)
+        
+        requestsByKey = {}
+        cacheKeys = {}
+        def addRequest (key, offer, filters, splits = 0):
+            post = self.getObservationsXml(offer, filters)
+            requestsByKey[key] = (offer, filters, splits, post)
+            chunkFileNames[key] = "{}-{}.xml".format(os.path.splitext(fileName)[0], len(chunkFileNames))
+            cacheKeys[key] = self.observationsCache.key(unicode(url.toString()), post)
+            chunk = manifest.chunk(post)
+            if chunk:
+                #Completada en un intento anterior
+                manifest.addChunk(post, chunk)
+            elif self.observationsCache.fresh(cacheKeys[key]):
+                self.observationsCache.get(cacheKeys[key])
+                chunk = self.observationsCache.fileName(cacheKeys[key])
+            if chunk:
+                self.readChunks (chunk, lambda data: layer.addData(data, key))
+                succeeded.append(key)
+                return
+            #Solo se limita el tamaño si se puede dividir la petición
+            canSplit = splits < self.maxRequestSplits and not len(self.selectedFeaturesOfInterest) and \
+                       len(filters.spatialTiles(2, extent = self.service[offer].observedArea)) > 1
+            queue.add (key, url, post,
+                       maxSize = maxReplySize if canSplit else 0)
+        
+        def requestTooLarge (key):
+            requestRetried(key)
+            offer, filters, splits, _ = requestsByKey[key]
+            for k, tile in enumerate(filters.spatialTiles(2, extent = self.service[offer].observedArea)):
+                addRequest (key + (k,), offer, tile, splits + 1)
+        
+        def updateProgress (done, total):
+            progressBar.setMaximum (total)
+            progressBar.setValue (done)
+        
+        def finishRequests ():
+            self.logTransfer (queue.wireBytes, queue.decodedBytes)
+            queue.deleteLater()
+            self.cmbOfferings.setEnabled (True)
+            self.tabWidget.setEnabled(True)
+            self.messageBar.clearWidgets()
+            if len(errors):
+                manifest.save()
+            else:
+                manifest.remove()
+            if not len(succeeded):
+                self.messageBar.pushMessage(errors[0] if len(errors) else self.tr("No observations downloaded"), QgsMessageBar.CRITICAL)
+            else:
+                if len(errors):
+                    self.messageBar.pushMessage(self.tr("{failed} of {total} requests failed, their observations aren't in the layer. Repeat the request to resume it").format(failed=len(errors), total=len(succeeded) + len(errors)), QgsMessageBar.WARNING, 10)
+                self.pendingLayer = layer
+                self.observationsRequest(fileName)
+        
+        queue.dataReceived.connect (dataReceived)
+        queue.requestRetried.connect (requestRetried)
+        queue.requestFinished.connect (requestFinished)
+        queue.requestTooLarge.connect (requestTooLarge)
+        queue.progress.connect (updateProgress)
+        queue.finished.connect (finishRequests)
+        self.messageBar.pushWidget(progressMessageBar, QgsMessageBar.INFO)
+        
+        for key, offer, filters in requests:
+            addRequest (key, offer, filters)
+        if not queue.inFlight:
+            finishRequests()
+    
+    @staticmethod
+    def readChunks (fileName, dataReceived):
+        """
+        Pass the content of fileName to dataReceived in chunks, as if it was downloaded
+        """
+        with open (fileName) as reply:
+            for data in iter(lambda: reply.read(ObservationsLayer.chunkSize), ""):
+                dataReceived (data)
+    
+    def logTransfer (self, wireBytes, decodedBytes):
+        """
+        Log downloaded size, compressed and decoded
+        """
+        QgsMessageLog.logMessage(self.tr("Downloaded {wire} bytes, {decoded} bytes decoded").format(wire=wireBytes, decoded=decodedBytes), "SosClient", QgsMessageLog.INFO)
+    
+    def newObservationsLayer (self, fileName = None):
+        return ObservationsLayer (self.layerName.text(), fileName, only1stGeo = self.rdoFirstObsGeo.isChecked(), stream = True, storage = self.selectedLayerStorage)
+    
+    def requestObservations (self, post):
+        """
+        Request observations, parsing the reply while it's downloaded.
+        Replies are stored in the observations cache, and the request isn't
+        sent if its reply is already there
+        """
+        self.pendingLayer = self.newObservationsLayer()
+        self.pendingLayer.requestUrl = unicode(self.service.getObservationsUrl.toString())
+        self.pendingLayer.requests = [post]
+        self.pendingLayer.afterFilter = "TM_After" in self.service.temporalOperators
+        keepReply = self.chkKeepReply.isChecked()
+        cacheKey = self.observationsCache.key(self.pendingLayer.requestUrl, post)
+        
+        if self.observationsCache.fresh(cacheKey):
+            self.messageBar.clearWidgets()
+            self.observationsCache.get(cacheKey)
+            QgsMessageLog.logMessage(self.tr("Observations read from cache"), "SosClient", QgsMessageLog.INFO)
+            self.readChunks (self.observationsCache.fileName(cacheKey), self.pendingLayer.addData)
+            fd, fileName = mkstemp(suffix=".xml", prefix = "observationsRequest", dir = self.selectedWorkDir())
+            os.close(fd)
+            if keepReply:
+                shutil.copyfile(self.observationsCache.fileName(cacheKey), fileName)
+            else:
+                os.remove(fileName)
+            self.observationsRequest(fileName)
+            return
+        
+        def observationsRequest (fileName):
+            #Las respuestas con excepción no se guardan
+            if not None in self.pendingLayer.sourceErrors:
+                self.observationsCache.put(cacheKey, fileName)
+            if not keepReply:
+                os.remove(fileName)
+            self.observationsRequest(fileName)
+        
+        self.executeRequest(self.service.getObservationsUrl, observationsRequest, post,
+                            dataReceived = self.pendingLayer.addData)
           
     def observationsRequest (self, fileName):
+        thread = None
         try:
-            layer = ObservationsLayer (self.layerName.text(), fileName, only1stGeo = self.rdoFirstObsGeo.isChecked())
+            layer, self.pendingLayer = self.pendingLayer, None
+            if layer:
+                layer.xmlFile = fileName
+            else:
+                layer = self.newObservationsLayer(fileName)
             
             def layerFinished ():
                 if progressBar:
                     self.iface.mainWindow().statusBar().removeWidget(progressBar)
                     progressBar.deleteLater()
+                if cancelButton:
+                    self.iface.mainWindow().statusBar().removeWidget(cancelButton)
+                    cancelButton.deleteLater()
                 layer.moveToThread(QtGui.QApplication.instance().thread())
                 if thread:
                     thread.deleteLater()
-                if not layer.vectorLayer.isValid():
+                if layer.canceled:
+                    self.messageBar.pushMessage(layer.error, QgsMessageBar.INFO, 3)
+                elif not layer.vectorLayer.isValid():
                     widget = self.messageBar.createMessage(layer.error)
-                    button = QtGui.QCommandLinkButton (widget)
-                    button.setText(self.tr("Show reply"))
-                    button.clicked.connect(XmlViewerDialog (self, QtCore.QFile(fileName), XmlHighlighter).exec_)
-                    widget.layout().addWidget(button)
+                    if os.path.exists(fileName):
+                        button = QtGui.QCommandLinkButton (widget)
+                        button.setText(self.tr("Show reply"))
+                        button.clicked.connect(XmlViewerDialog (self, QtCore.QFile(fileName), XmlHighlighter).exec_)
+                        widget.layout().addWidget(button)
                     self.messageBar.pushWidget(widget, QgsMessageBar.CRITICAL)
                 else :
+                    if len(layer.sourceErrors):
+                        self.messageBar.pushMessage("; ".join(set(layer.sourceErrors.values())), QgsMessageBar.WARNING, 10)
                     QgsMapLayerRegistry.instance().addMapLayer(layer.vectorLayer)
                     if self.createTimeManagerLayer:
                         self.addLayerToTimeManager (layer.vectorLayer)
@@ -580,18 +970,31 @@ class SOSClientDialog(QtGui.QDialog, WidgetFactory.getClass('sos_client_dialog')
             progressBar.setRange(0,0)
             progressBar.setVisible (True)
             
+            def layerProgress (done, total):
+                progressBar.setRange(0, total)
+                progressBar.setValue(done)
+            
+            cancelButton = QtGui.QToolButton(self)
+            cancelButton.setText(self.tr("Cancel"))
+            cancelButton.setToolTip(self.tr("Cancel layer load"))
+            self.iface.mainWindow().statusBar().insertWidget(1, cancelButton)
+            
             
             thread = QtCore.QThread(self)
             layer.moveToThread(thread)
             thread.started.connect (layer.toVectorLayer)
+            layer.progress.connect (layerProgress, QtCore.Qt.QueuedConnection)
             layer.finished.connect (layerFinished, QtCore.Qt.QueuedConnection)
+            #La capa está ocupada en su hilo, cancel solo activa un indicador
+            cancelButton.clicked.connect (layer.cancel, QtCore.Qt.DirectConnection)
             thread.start()
         except Exception as error:
             widget = self.messageBar.createMessage(unicode(error))
-            button = QtGui.QCommandLinkButton (widget)
-            button.setText(self.tr("Show reply"))
-            button.clicked.connect(XmlViewerDialog (self, QtCore.QFile(fileName), XmlHighlighter).exec_)
-            widget.layout().addWidget(button)
+            if os.path.exists(fileName):
+                button = QtGui.QCommandLinkButton (widget)
+                button.setText(self.tr("Show reply"))
+                button.clicked.connect(XmlViewerDialog (self, QtCore.QFile(fileName), XmlHighlighter).exec_)
+                widget.layout().addWidget(button)
             self.messageBar.pushWidget(widget, QgsMessageBar.CRITICAL)
             if thread:
                 thread.deleteLater()
@@ -60,6 +60,8 @@ class SOSPlotDialog(QtGui.QDialog, WidgetFactory.getClass('sosplot_dialog')):
         self.foiList = list(self.foiList)
         self.foiList.sort()
         self.plotWidget.genColorMap (len(self.foiList))
+        #Series por par de propiedades, ver dataSeries
+        self._dataSeries = {}
         
         self.xProperty.addItems([str(f.name()) for f in list(layer.pendingFields())[2:]])
         self.yProperty.addItems([str(f.name()) for f in list(layer.pendingFields())[2:]])
@@ -195,30 +197,52 @@ class SOSPlotDialog(QtGui.QDialog, WidgetFactory.getClass('sosplot_dialog')):
                                yField = yField,
                                resetStyle = resetStyle)
 
-        request = QgsFeatureRequest ()
-        request.setFlags(QgsFeatureRequest.NoGeometry)
-                
-        for foi in self.foiList:
-            request.setFilterExpression("foi = '%s'" % foi)
+        dataSeries = self.dataSeries (xField, yField)
+        for name, xValues, yValues in dataSeries:
             if ySorted:
-                dataSerie = [(f.attribute(yField),f.attribute(xField)) for f in self.layer.getFeatures(request)]
+                dataSerie = zip(yValues, xValues)
             else:
-                dataSerie = [(f.attribute(xField),f.attribute(yField)) for f in self.layer.getFeatures(request)]
+                dataSerie = zip(xValues, yValues)
             dataSerie.sort()
             
-            if len (dataSerie):
-                if ySorted:
-                    y,x = map(list, zip(*dataSerie))
-                else:
-                    x,y = map(list, zip(*dataSerie))
-                self.plotWidget.plot(x,y, f.attribute('name'))
-                self.plotWidget.applyTimeFormat (self.timeFormat.text())
-                self.plotWidget.draw ()
+            if ySorted:
+                y,x = map(list, zip(*dataSerie))
+            else:
+                x,y = map(list, zip(*dataSerie))
+            self.plotWidget.plot(x,y, name)
+        
+        if len (dataSeries):
+            self.plotWidget.applyTimeFormat (self.timeFormat.text())
+            self.plotWidget.draw ()
         
         styles = self.StylesTable (self.plotWidget.ax.get_lines())
         self.stylesTable.setModel (styles)
         styles.dataChanged.connect(self.plotWidget.draw)
     
+    def dataSeries (self, xField, yField):
+        """
+        Values of xField and yField by feature of interest, taken from a
+        single layer scan and cached by fields pair
+        :return: (name, x values, y values) by feature of interest in foiList,
+        without empty series
+        :rtype: tuple list
+        """
+        key = (xField, yField)
+        if not key in self._dataSeries:
+            request = QgsFeatureRequest ()
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes(['foi', 'name', xField, yField], self.layer.pendingFields())
+            
+            series = {foi : [None, [], []] for foi in self.foiList}
+            for f in self.layer.getFeatures(request):
+                serie = series.get(f.attribute('foi'))
+                if serie != None:
+                    serie[0] = f.attribute('name')
+                    serie[1].append(f.attribute(xField))
+                    serie[2].append(f.attribute(yField))
+            self._dataSeries[key] = [tuple(series[foi]) for foi in self.foiList if len(series[foi][1])]
+        return self._dataSeries[key]
+    
     def styleFromPlot (self):
         self.lineWidth.setValue (rcParams['lines.linewidth'])
         lineStyle = '' if rcParams['lines.linestyle'] in ['None', None, ' '] else rcParams['lines.linestyle']
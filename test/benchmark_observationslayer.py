@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+ObservationsLayer storage backends: layer generation time plus one full
+read of the generated layer, as QGIS does when it is drawn.
+
+Usage (from plugin directory): python -m test.benchmark_observationslayer
+"""
+
+import os
+import shutil
+import tempfile
+from timeit import default_timer
+from test.utilities import get_qgis_app
+from sos.sos import ObservationsLayer
+
+QGIS_APP = get_qgis_app()
+
+XMLFILES = ['test/observationsMeteogalicia.xml', 'test/observationsIntecmar.xml', 'test/measurementsIntecmar.xml']
+STORAGES = [ObservationsLayer.GeoJSON, ObservationsLayer.Memory, ObservationsLayer.GeoPackage, ObservationsLayer.SpatiaLite]
+REPEAT = 5
+
+def run (xmlFile, storage):
+    layer = ObservationsLayer (os.path.basename(xmlFile), xmlFile, storage = storage)
+    start = default_timer()
+    layer.toVectorLayer()
+    count = sum(1 for _ in layer.vectorLayer.getFeatures())
+    elapsed = default_timer() - start
+    if layer.error:
+        raise Exception (layer.error)
+    return elapsed, count
+
+def main ():
+    workDir = tempfile.mkdtemp()
+    try:
+        print "{:<30} {:<10} {:>8} {:>10}".format("file", "storage", "features", "best (ms)")
+        for xmlFile in XMLFILES:
+            #Copy, so generated files are not written into test dir
+            fileName = os.path.join(workDir, os.path.basename(xmlFile))
+            shutil.copy (xmlFile, fileName)
+            for storage in STORAGES:
+                results = [run (fileName, storage) for _ in range(REPEAT)]
+                print "{:<30} {:<10} {:>8} {:>10.1f}".format(os.path.basename(xmlFile), storage, results[0][1], min(r[0] for r in results) * 1000)
+    finally:
+        shutil.rmtree (workDir, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+QgsTime._parse with the strict ISO 8601 fast path versus dateutil parser,
+over the samplingTime and DataArray time tokens of the observations
+fixtures. Both results are checked to be the same datetime.
+
+Usage (from plugin directory): python -m test.benchmark_qgstime
+"""
+
+import re
+from timeit import Timer
+from dateutil import parser as DateTimeParser
+from sos.qgstime import QgsTime, parseIsoDateTime
+
+XMLFILES = ['test/observationsMeteogalicia.xml', 'test/observationsIntecmar.xml', 'test/measurementsIntecmar.xml']
+#Posiciones de samplingTime y tokens de DataArray
+TOKEN = re.compile(r"\d{4}-\d\d-\d\dT[\d:.,]+(?:Z|[+-]\d\d:?\d\d)?")
+REPEAT = 5
+SCALE = 20
+
+def main ():
+    tokens = []
+    for xmlFile in XMLFILES:
+        with open (xmlFile) as xml:
+            tokens += TOKEN.findall(xml.read())
+    tokens *= SCALE
+
+    for token in set(tokens):
+        assert parseIsoDateTime(token) == DateTimeParser.parse(token), token
+
+    time = QgsTime()
+    cases = [('dateutil parser', lambda: [DateTimeParser.parse(token) for token in tokens]),
+             ('QgsTime._parse', lambda: [time._parse(token) for token in tokens]),
+             ('parseIsoDateTime', lambda: [parseIsoDateTime(token) for token in tokens])]
+
+    print "{} time tokens, {} distinct".format(len(tokens), len(set(tokens)))
+    for name, case in cases:
+        best = min(Timer(case).repeat(REPEAT, 1))
+        print "{:<20} {:8.3f} ms {:8.2f} us/token".format(name, best * 1000, best * 1e6 / len(tokens))
+
+if __name__ == "__main__":
+    main()
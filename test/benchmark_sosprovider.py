@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+SOSProvider.setObservation scaling with the number of timestamps by
+feature of interest. The list.index lookup used before the time index
+is timed as reference up to 10k timestamps, as it is O(N^2).
+
+Observations storage size of test/measurementsIntecmar.xml scaled up
+100 times, compared with one properties dict by feature and time.
+
+Usage (from plugin directory): python -m test.benchmark_sosprovider
+"""
+
+import sys
+from timeit import Timer
+from PyQt4.QtCore import QDateTime, QFile, QVariant
+from sos.sos import SOSProvider, XMLParserFactory
+
+SIZES = [1000, 10000, 100000]
+REFERENCE_MAX_SIZE = 10000
+PROPERTIES = ['Temperatura', 'Salinidade']
+
+def timeColumn (size):
+    start = QDateTime.fromString('2015-01-01T00:00:00', 'yyyy-MM-ddThh:mm:ss').toMSecsSinceEpoch()
+    return [start + 600000 * i for i in range(size)]
+
+def indexedProvider (times):
+    provider = SOSProvider()
+    for prop in PROPERTIES:
+        for time in times:
+            provider.setObservation ('foi', time, prop, '1.0', QVariant.Double)
+    return provider
+
+def listIndexReference (times):
+    timeList = []
+    propertiesList = []
+    for prop in PROPERTIES:
+        for time in times:
+            try:
+                propertiesList[timeList.index(time)][prop] = '1.0'
+            except ValueError:
+                timeList.append(time)
+                propertiesList.append({prop: '1.0'})
+
+XMLFILE = 'test/measurementsIntecmar.xml'
+SCALE = 100
+
+class RecordingProvider (SOSProvider):
+    def __init__(self):
+        super (RecordingProvider, self).__init__()
+        self.calls = []
+    
+    def setObservation (self, *args):
+        self.calls.append (args)
+        SOSProvider.setObservation (self, *args)
+
+def sizeOf (obj, seen = None):
+    """
+    Approximate deep size of containers, only the Python wrapper of Qt objects is counted
+    """
+    seen = seen if seen != None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance (obj, dict):
+        size += sum(sizeOf(k, seen) + sizeOf(v, seen) for k, v in obj.iteritems())
+    elif isinstance (obj, (list, tuple, set)):
+        size += sum(sizeOf(v, seen) for v in obj)
+    return size
+
+def scaledObservations ():
+    parser = XMLParserFactory.getInstance("SOSObservations")()
+    parser.provider = RecordingProvider()
+    parser.parse(QFile(XMLFILE))
+    for copy in range(SCALE):
+        for args in parser.provider.calls:
+            foi, time = args[:2]
+            if time != None:
+                time = (time[0] + copy * 366 * 86400000, time[1])
+            yield (foi, time) + args[2:]
+
+def rowDictReference (observations):
+    store = {}
+    for foi, time, prop, value in (args[:4] for args in observations):
+        timeList, propertiesList, timeIndex = store.setdefault(foi, ([], [], {}))
+        try:
+            propertiesList[timeIndex[time]][prop] = value
+        except KeyError:
+            timeIndex[time] = len(timeList)
+            timeList.append(time)
+            propertiesList.append({prop: value})
+    return store
+
+def memory ():
+    observations = list(scaledObservations())
+    provider = SOSProvider()
+    for args in observations:
+        provider.setObservation (*args)
+    columnar = sizeOf([provider._fois, provider._foiCodes, provider._rows, provider._foiColumn,
+                       provider._timeColumn, provider._zoneColumn, provider._properties, provider._propertyColumns])
+    reference = sizeOf(rowDictReference(observations))
+    print "{} observations, {} rows".format(len(observations), len(provider._timeColumn))
+    print "columnar {:.1f} KiB, row dicts {:.1f} KiB, ratio {:.1f}x".format(columnar / 1024., reference / 1024., float(reference) / columnar)
+
+def main ():
+    print "{:>8} {:>14} {:>14}".format("times", "indexed (s)", "list.index (s)")
+    for size in SIZES:
+        times = timeColumn (size)
+        indexed = Timer(lambda: indexedProvider(times)).timeit(1)
+        reference = Timer(lambda: listIndexReference(times)).timeit(1) if size <= REFERENCE_MAX_SIZE else None
+        print "{:>8} {:>14.3f} {:>14}".format(size, indexed, "{:.3f}".format(reference) if reference != None else "-")
+    print
+    memory ()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+XMLParser.search per call overhead, parsing the query on each call
+versus cached compiled queries.
+
+Usage (from plugin directory): python -m test.benchmark_xmlparser
+"""
+
+from timeit import Timer
+from PyQt4.QtCore import QFile
+from sos.xmlparser import XMLParser, XMLQuery
+
+XMLFILE = 'test/measurementsIntecmar.xml'
+QUERIES = ['Measurement/*', '@href', 'FeatureCollection/featureMember/SamplingPoint@id',
+           'SamplingPoint@id', 'SamplingPointAtDepth@id', 'name', 'position', 'depth']
+REPEAT = 5
+
+def searchMembers (members, compiler):
+    queries = [compiler(q) for q in QUERIES]
+    for member in members:
+        for query in queries:
+            XMLParser.searchFirst(member, query)
+
+def main ():
+    xml = XMLParser().parse(QFile(XMLFILE))
+    members = [member for member, _ in XMLParser.search(xml, 'member')]
+    calls = len(members) * len(QUERIES)
+    
+    cases = [('query parsed on each call', lambda: [XMLParser.searchFirst(member, XMLQuery(q)) for member in members for q in QUERIES]),
+             ('cached compiled query', lambda: [XMLParser.searchFirst(member, q) for member in members for q in QUERIES]),
+             ('precompiled query', lambda: searchMembers(members, XMLQuery))]
+    
+    print "{} members, {} searchFirst calls".format(len(members), calls)
+    for name, case in cases:
+        best = min(Timer(case).repeat(REPEAT, 1))
+        print "{:<30} {:8.3f} ms {:8.2f} us/call".format(name, best * 1000, best * 1e6 / calls)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+from sos.cache import FileCache, CapabilitiesCache, ObservationsCache
+
+
+class CacheTest(unittest.TestCase):
+
+    """Test reply caches works."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        fd, self.reply = tempfile.mkstemp(suffix=".xml")
+        os.write(fd, "x" * 100)
+        os.close(fd)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+        os.remove(self.reply)
+
+    def test_put_get(self):
+        cache = FileCache(os.path.join(self.directory, "cache"))
+        cache.put("key", self.reply, etag='"1"')
+        self.assertIn("key", cache)
+        self.assertEqual(cache.get("key")['etag'], '"1"')
+        self.assertEqual(cache.size, 100)
+        self.assertEqual(open(cache.fileName("key")).read(), "x" * 100)
+
+        #Index is persistent
+        cache = FileCache(os.path.join(self.directory, "cache"))
+        self.assertIn("key", cache)
+        cache.remove("key")
+        self.assertNotIn("key", cache)
+        self.assertFalse(os.path.exists(cache.fileName("key")))
+
+    def test_evict(self):
+        cache = FileCache(self.directory, maxSize = 250)
+        cache.put("a", self.reply)
+        cache.put("b", self.reply)
+        cache._index["a"]['used'] += 10
+        cache.put("c", self.reply)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("b", cache)
+        self.assertLessEqual(cache.size, 250)
+
+    def test_capabilities(self):
+        cache = CapabilitiesCache(self.directory, ttl = 60)
+        url = u"http://sos.example.com/sos?Service=SOS&Request=GetCapabilities"
+        self.assertFalse(cache.fresh(url))
+        self.assertEqual(cache.validators(url), {})
+
+        cache.put(url, self.reply, etag='"abc"', lastModified="Mon, 02 Mar 2015 10:00:00 GMT")
+        self.assertTrue(cache.fresh(url))
+        self.assertEqual(cache.validators(url), {'If-None-Match': '"abc"', 'If-Modified-Since': "Mon, 02 Mar 2015 10:00:00 GMT"})
+
+        cache._index[url]['stored'] -= 120
+        self.assertFalse(cache.fresh(url))
+        cache.revalidated(url)
+        self.assertTrue(cache.fresh(url))
+
+    def test_observations(self):
+        cache = ObservationsCache(self.directory, ttl = 60)
+        url = u"http://sos.example.com/sos"
+        post = u"""<?xml version="1.0" encoding="UTF-8"?>
+<GetObservation xmlns="http://www.opengis.net/sos/1.0" service="SOS" version="1.0.0">
+    <offering>Estación</offering>
+</GetObservation>"""
+        same = u"""<sos:GetObservation version="1.0.0" service="SOS" xmlns:sos="http://www.opengis.net/sos/1.0"><sos:offering>Estación</sos:offering></sos:GetObservation>"""
+        other = post.replace(u"Estación", u"Otra")
+        self.assertEqual(cache.key(url, post), cache.key(url, same))
+        self.assertNotEqual(cache.key(url, post), cache.key(url, other))
+        self.assertNotEqual(cache.key(url, post), cache.key(url + "2", post))
+        self.assertEqual(cache.key(url, "<GetObservation"), cache.key(url, " <GetObservation\n"))
+        #Valores con caracteres de marcado
+        self.assertNotEqual(cache.key(url, u"""<a x='1"&gt;&lt;b x="2'/>"""), cache.key(url, u"""<a x="1"><b x="2"/></a>"""))
+        self.assertNotEqual(cache.key(url, u"<a>&lt;b&gt;&lt;/b&gt;</a>"), cache.key(url, u"<a><b></b></a>"))
+
+        key = cache.key(url, post)
+        self.assertFalse(cache.fresh(key))
+        cache.put(key, self.reply)
+        self.assertTrue(cache.fresh(key))
+        cache._index[key]['stored'] -= 120
+        self.assertFalse(cache.fresh(key))
+        self.assertNotIn(key, cache)
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(CacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+import zlib
+from sos.network import ReplyDecoder, DownloadManifest, ReplyFile
+
+
+class FakeReply(object):
+    def __init__(self, encoding = "", status = 200, headers = {}):
+        self.status = status
+        self.headers = dict(headers)
+        self.headers["Content-Encoding"] = encoding
+
+    def rawHeader(self, header):
+        return self.headers.get(header, "")
+
+    def attribute(self, code):
+        return self.status
+
+
+class ReplyDecoderTest(unittest.TestCase):
+
+    """Test compressed replies are decoded."""
+
+    xml = "<om:ObservationCollection>" + "<om:member/>" * 1000 + "</om:ObservationCollection>"
+
+    def decode(self, encoding, data, chunk = 100):
+        decoder = ReplyDecoder(FakeReply(encoding))
+        decoded = "".join(decoder.decode(data[i:i + chunk]) for i in range(0, len(data), chunk))
+        decoded += decoder.flush()
+        self.assertEqual(decoder.wireBytes, len(data))
+        self.assertEqual(decoder.decodedBytes, len(decoded))
+        return decoder, decoded
+
+    def test_identity(self):
+        decoder, decoded = self.decode("", self.xml)
+        self.assertEqual(decoded, self.xml)
+
+    def test_gzip(self):
+        compress = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compress.compress(self.xml) + compress.flush()
+        decoder, decoded = self.decode("gzip", data)
+        self.assertEqual(decoded, self.xml)
+        self.assertLess(decoder.wireBytes, decoder.decodedBytes)
+
+    def test_deflate(self):
+        decoder, decoded = self.decode("deflate", zlib.compress(self.xml))
+        self.assertEqual(decoded, self.xml)
+
+        #Raw deflate without zlib header
+        compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        decoder, decoded = self.decode("deflate", compress.compress(self.xml) + compress.flush())
+        self.assertEqual(decoded, self.xml)
+
+    def test_error(self):
+        decoder = ReplyDecoder(FakeReply("gzip"))
+        self.assertEqual(decoder.decode(self.xml), "")
+        self.assertTrue(decoder.error)
+        self.assertEqual(decoder.flush(), "")
+
+
+class DownloadManifestTest(unittest.TestCase):
+
+    """Test interrupted downloads are resumed."""
+
+    url = u"http://sos.example.com/sos"
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.reply = os.path.join(self.directory, "reply.xml")
+        with open(self.reply, "w") as reply:
+            reply.write("x" * 100)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+
+    def test_range(self):
+        manifest = DownloadManifest(self.directory, self.url, [u"<GetObservation/>"])
+        self.assertFalse(manifest.resumable)
+        manifest.keep(self.reply, FakeReply(headers = {"ETag": '"1"'}))
+
+        manifest = DownloadManifest(self.directory, self.url, [u"<GetObservation/>"])
+        self.assertTrue(manifest.resumable)
+        self.assertEqual(manifest.rangeHeaders(), {'Range': "bytes=100-", 'Accept-Encoding': "identity", 'If-Range': '"1"'})
+        self.assertTrue(manifest.resumed(FakeReply(status = 206, headers = {"Content-Range": "bytes 100-199/200"})))
+        self.assertFalse(manifest.resumed(FakeReply(status = 206, headers = {"Content-Range": "bytes 0-199/200"})))
+        self.assertFalse(manifest.resumed(FakeReply(status = 200)))
+
+        #Other request or changed partial reply
+        self.assertFalse(DownloadManifest(self.directory, self.url, [u"<GetObservation></GetObservation>"]).resumable)
+        with open(self.reply, "a") as reply:
+            reply.write("x")
+        self.assertFalse(manifest.resumable)
+
+        manifest.remove()
+        self.assertFalse(os.path.exists(manifest.fileName))
+        self.assertTrue(os.path.exists(self.reply))
+
+    def test_chunks(self):
+        posts = ["<GetObservation>1</GetObservation>", "<GetObservation>2</GetObservation>"]
+        manifest = DownloadManifest(self.directory, self.url, posts)
+        manifest.addChunk(posts[0], self.reply)
+        manifest.save()
+
+        manifest = DownloadManifest(self.directory, self.url, posts)
+        self.assertEqual(manifest.chunk(posts[0]), self.reply)
+        self.assertEqual(manifest.chunk(posts[1]), None)
+        manifest.remove()
+        self.assertFalse(os.path.exists(self.reply))
+        self.assertFalse(os.path.exists(manifest.fileName))
+
+    def test_resume_failed(self):
+        posts = [u"<GetObservation/>"]
+        DownloadManifest(self.directory, self.url, posts).keep(self.reply, FakeReply())
+
+        #Retry fails before any data arrives
+        manifest = DownloadManifest(self.directory, self.url, posts)
+        self.assertTrue(manifest.resumable)
+        replyFile = ReplyFile(manifest.replyFileName, manifest, resume = True)
+        self.assertTrue(replyFile.finish(FakeReply(status = None), failed = True))
+        self.assertEqual(os.path.getsize(self.reply), 100)
+        self.assertTrue(os.path.exists(manifest.fileName))
+        self.assertTrue(DownloadManifest(self.directory, self.url, posts).resumable)
+
+        #Retry resumed and completed
+        reply = FakeReply(status = 206, headers = {"Content-Range": "bytes 100-199/200"})
+        replyFile = ReplyFile(manifest.replyFileName, manifest, resume = True)
+        self.assertTrue(replyFile.open(reply))
+        replyFile.write(reply, "y" * 100)
+        self.assertFalse(replyFile.finish(reply, failed = False, keepFile = True))
+        self.assertEqual(os.path.getsize(self.reply), 200)
+        self.assertFalse(os.path.exists(manifest.fileName))
+
+if __name__ == "__main__":
+    for test in [ReplyDecoderTest, DownloadManifestTest]:
+        suite = unittest.makeSuite(test)
+        runner = unittest.TextTestRunner(verbosity=2)
+        runner.run(suite)
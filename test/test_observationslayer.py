@@ -6,8 +6,14 @@ Created on 28 Feb, 2015
 '''
 
 import unittest
+import os
+import re
+import shutil
+import tempfile
+import time
 from PyQt4.QtCore import Qt #@UnusedImport
 from sos.sos import * #@UnusedWildImport
+from sos.sosparser import TimeTable, decodeTextBlock
 
 
 class ObservationsLayerTest(unittest.TestCase):
@@ -61,7 +67,290 @@ class ObservationsLayerTest(unittest.TestCase):
         self.assertEqual (",".join([str(f.name()) for f in layer.provider.fields]), "foi,name,Time,Temperatura,Salinidade,Profundidade")
         self.assertEqual ((unicode(layer)).split(";")[1], u"(u'ctd_Ares_42', u'10.617'): 2015-04-20T09:14:00-{u'Temperatura': '13.449999809265137', u'Salinidade': '35.344398498535156', u'Profundidade': '10.616999626159668'},")
         self.assertEqual (layer.vectorLayer.name(), layer.name)
+        
+    def test_incompleteMeasurements (self):
+        with open (self.observationFiles ['measurementsIntecmar.xml']) as xml:
+            members = xml.read().split("</om:member>")
+        #Sin tiempo en la primera medida y sin feature of interest en la segunda
+        members[0] = re.sub(r"(?s)<om:samplingTime>.*</om:samplingTime>", "", members[0])
+        members[1] = re.sub(r"(?s)<om:featureOfInterest>.*</om:featureOfInterest>", "", members[1])
+        tempDir = tempfile.mkdtemp()
+        try:
+            xmlFile = os.path.join(tempDir, 'measurementsIntecmar.xml')
+            with open (xmlFile, "w") as xml:
+                xml.write("</om:member>".join(members))
+            for stream in [False, True]:
+                layer = ObservationsLayer ('measurementsIntecmar.xml', xmlFile, stream = stream, storage = ObservationsLayer.Memory)
+                layer.toVectorLayer()
+                self.assertTrue (layer.vectorLayer.isValid(), layer.error)
+                self.assertNotIn ("13.60789966583252", unicode(layer))
+                self.assertNotIn ("35.255001068115234", unicode(layer))
+        finally:
+            shutil.rmtree (tempDir)
+        
+    def test_streamParser (self):
+        for name, xmlFile in self.observationFiles.items():
+            layer = ObservationsLayer (name, xmlFile)
+            layer.toVectorLayer()
+            streamLayer = ObservationsLayer (name, xmlFile, stream = True)
+            streamLayer.toVectorLayer()
+            
+            self.assertEqual (unicode(streamLayer), unicode(layer))
+            self.assertEqual ([str(f.name()) for f in streamLayer.provider.fields], [str(f.name()) for f in layer.provider.fields])
+            self.assertEqual (streamLayer.provider.extent, layer.provider.extent)
+        
+    def test_layerStorages (self):
+        #Los ficheros de las capas se crean junto al XML, fuera de test
+        tempDir = tempfile.mkdtemp()
+        try:
+            for name, xmlFile in self.observationFiles.items():
+                xmlFile = shutil.copy (xmlFile, tempDir) or os.path.join(tempDir, os.path.basename(xmlFile))
+                layer = ObservationsLayer (name, xmlFile)
+                layer.toVectorLayer()
+                for storage in [ObservationsLayer.Memory, ObservationsLayer.GeoPackage, ObservationsLayer.SpatiaLite]:
+                    storageLayer = ObservationsLayer (name, xmlFile, storage = storage)
+                    storageLayer.toVectorLayer()
+                    
+                    self.assertTrue (storageLayer.vectorLayer.isValid(), storage)
+                    self.assertEqual (storageLayer.vectorLayer.featureCount(), layer.vectorLayer.featureCount())
+                    self.assertEqual ([str(f.name()) for f in storageLayer.vectorLayer.pendingFields()][-len(layer.provider.fields):], [str(f.name()) for f in layer.vectorLayer.pendingFields()])
+        finally:
+            shutil.rmtree (tempDir)
+        
+    def test_streamParserChunks (self):
+        parser = XMLParserFactory.getInstance("SOSObservationsStream")()
+        with open (self.observationFiles ['observationsIntecmar.xml']) as xml:
+            for chunk in iter(lambda: xml.read(1024), ''):
+                parser.addData(chunk)
+        provider = parser.finish()
+        
+        layer = ObservationsLayer ('observationsIntecmar.xml', self.observationFiles ['observationsIntecmar.xml'])
+        layer.toVectorLayer()
+        self.assertEqual (provider.getObservation(), layer.provider.getObservation())
+
+    def test_addData (self):
+        xmlFile = self.observationFiles ['observationsIntecmar.xml']
+        layer = ObservationsLayer ('observationsIntecmar.xml', xmlFile)
+        layer.toVectorLayer()
+        
+        pipelinedLayer = ObservationsLayer ('observationsIntecmar.xml', storage = ObservationsLayer.Memory)
+        with open (xmlFile) as xml:
+            for chunk in iter(lambda: xml.read(1024), ''):
+                pipelinedLayer.addData(chunk)
+        pipelinedLayer.toVectorLayer()
+        self.assertTrue (pipelinedLayer.vectorLayer.isValid())
+        self.assertEqual (pipelinedLayer.provider.getObservation(), layer.provider.getObservation())
+        
+        errorLayer = ObservationsLayer ('exceptionreport.xml', storage = ObservationsLayer.Memory)
+        with open ('test/exceptionreport.xml') as xml:
+            errorLayer.addData(xml.read())
+        errorLayer.toVectorLayer()
+        self.assertFalse (errorLayer.vectorLayer.isValid())
+        self.assertNotEqual (errorLayer.error, "")
+        
+    def test_addDataSources (self):
+        merged = ObservationsLayer ('merged', storage = ObservationsLayer.Memory)
+        names = ['observationsIntecmar.xml', 'measurementsIntecmar.xml']
+        for name in names:
+            with open (self.observationFiles [name]) as xml:
+                for chunk in iter(lambda: xml.read(1024), ''):
+                    merged.addData(chunk, name)
+        merged.addData("<ObservationCollection", "broken")
+        merged.toVectorLayer()
+        
+        self.assertTrue (merged.vectorLayer.isValid())
+        self.assertEqual (merged.sourceErrors.keys(), ["broken"])
+        fields = [str(f.name()) for f in merged.provider.fields]
+        self.assertEqual (fields[:3], ["foi", "name", "Time"])
+        for name in names:
+            layer = ObservationsLayer (name, self.observationFiles [name])
+            layer.toVectorLayer()
+            self.assertTrue (set(str(f.name()) for f in layer.provider.fields).issubset(fields))
+            self.assertTrue (merged.provider.extent.contains(layer.provider.extent))
+        
+    def test_discardSource (self):
+        xmlFile = self.observationFiles ['observationsIntecmar.xml']
+        layer = ObservationsLayer ('observationsIntecmar.xml', xmlFile)
+        layer.toVectorLayer()
+        
+        #Petición que falla después de recibir parte de la respuesta
+        partial = ObservationsLayer ('partial', storage = ObservationsLayer.Memory)
+        with open (xmlFile) as xml:
+            partial.addData(xml.read(), "complete")
+        with open (self.observationFiles ['measurementsIntecmar.xml']) as xml:
+            partial.addData(xml.read(1 << 14), "failed")
+        partial.discardSource("failed")
+        partial.toVectorLayer()
+        self.assertTrue (partial.vectorLayer.isValid())
+        self.assertEqual (partial.sourceErrors, {})
+        self.assertEqual (partial.provider.getObservation(), layer.provider.getObservation())
+        
+    def test_retrySource (self):
+        xmlFile = self.observationFiles ['measurementsIntecmar.xml']
+        layer = ObservationsLayer ('measurementsIntecmar.xml', xmlFile)
+        layer.toVectorLayer()
+        
+        #El reintento devuelve otra respuesta que el intento abortado
+        retried = ObservationsLayer ('retried', storage = ObservationsLayer.Memory)
+        with open (self.observationFiles ['observationsIntecmar.xml']) as xml:
+            retried.addData(xml.read(1 << 14), "request")
+        retried.discardSource("request")
+        with open (xmlFile) as xml:
+            retried.addData(xml.read(), "request")
+        retried.toVectorLayer()
+        self.assertTrue (retried.vectorLayer.isValid())
+        self.assertEqual (retried.provider.getObservation(), layer.provider.getObservation())
+        
+    def test_progressCancel (self):
+        xmlFile = self.observationFiles ['observationsIntecmar.xml']
+        layer = ObservationsLayer ('observationsIntecmar.xml', xmlFile, stream = True)
+        layer.chunkSize = 1024
+        progress = []
+        layer.progress.connect (lambda done, total: progress.append((done, total)))
+        layer.toVectorLayer()
+        self.assertTrue (layer.vectorLayer.isValid())
+        self.assertTrue (len(progress) > 1)
+        self.assertEqual (progress[-1], (layer.provider.featureCount, layer.provider.featureCount))
+        
+        tempDir = tempfile.mkdtemp()
+        try:
+            xmlFile = shutil.copy (xmlFile, tempDir) or os.path.join(tempDir, os.path.basename(xmlFile))
+            layer = ObservationsLayer ('observationsIntecmar.xml', xmlFile, stream = True)
+            layer.chunkSize = 1024
+            layer.progress.connect (lambda done, total: layer.cancel())
+            layer.toVectorLayer()
+            self.assertTrue (layer.canceled)
+            self.assertFalse (layer.vectorLayer.isValid())
+            self.assertIsNone (layer.provider)
+            self.assertFalse (os.path.exists(xmlFile.replace(".xml", ".geojson")))
+        finally:
+            shutil.rmtree (tempDir)
 
+    def test_timeTable (self):
+        parsed = []
+        times = TimeTable (lambda text: parsed.append(text) or QDateTime.fromString(text, Qt.ISODate))
+        self.assertIs (times["2015-01-28T20:40:00"], times["2015-01-28T20:40:00"])
+        self.assertEqual (times["2015-01-28T20:50:00"], QDateTime.fromString("2015-01-28T20:50:00", Qt.ISODate))
+        self.assertEqual (parsed, ["2015-01-28T20:40:00", "2015-01-28T20:50:00"])
+        
+    def test_decodeTextBlock (self):
+        """ TextBlock values by columns """
+        self.assertEqual (decodeTextBlock ("a,1,x@@b,2,y@@", "@@", ",", 3), [['a', 'b'], ['1', '2'], ['x', 'y']])
+        self.assertEqual (decodeTextBlock ("a,1,x,extra@@b,2", "@@", ",", 3), [['a', 'b'], ['1', '2'], ['x', '']])
+        self.assertEqual (decodeTextBlock ("a,1@@@@b,2,y", "@@", ",", 3), [['a', 'b'], ['1', '2'], ['', 'y']])
+        self.assertEqual (decodeTextBlock (" ", "@@", ",", 2), [[], []])
+        self.assertEqual (decodeTextBlock ("a,1,b,2,c", ",", ",", 2), [['a', 'b', 'c'], ['1', '2', '']])
+        #Valores con caracteres del separador
+        self.assertEqual (decodeTextBlock ("@a,1@@b,2@", "@@", ",", 2), [['@a', 'b'], ['1', '2@']])
+        self.assertEqual (decodeTextBlock ("a,1;@@b,2;", ";@@", ",", 2), [['a', 'b'], ['1', '2;']])
+        
+    def test_observationsBulk (self):
+        """ Columns set at once match observations set one by one """
+        fois, times = ["a", "b", "a", "a"], [0, 0, 1000, 0]
+        bulk, single = SOSProvider (), SOSProvider ()
+        for prop, values, fieldType in [("t", ["1", "-", "3", "4"], QVariant.Double), ("code", ["001", "x", "3", "4"], QVariant.String)]:
+            bulk.setObservations (fois, times, prop, values, fieldType)
+            for args in zip(fois, times, [prop] * 4, values, [fieldType] * 4):
+                single.setObservation (*args)
+        self.assertEqual (bulk.getObservation(), single.getObservation())
+        self.assertEqual ([bulk._value("t", row) for row in range(3)], [4.0, None, 3.0])
+        self.assertEqual ([bulk._value("code", row) for row in range(3)], ["4", "x", "3"])
+        
+    def test_timeZones (self):
+        """ Times with zone are kept in UTC whatever the local zone is """
+        localZone = os.environ.get("TZ")
+        os.environ["TZ"] = "Europe/Madrid"
+        time.tzset()
+        try:
+            provider = SOSProvider ()
+            times = TimeTable ()
+            provider.setObservation ("foi", times["2015-01-28T20:40:00Z"], "t", "1", QVariant.Double)
+            provider.setObservation ("foi", times["2015-01-28T22:50:00+01:00"], "t", "2", QVariant.Double)
+            provider.setObservation ("foi", times["2015-01-28T23:00:00"], "t", "3", QVariant.Double)
+            self.assertEqual (provider.getObservation(), ";foi: 2015-01-28T20:40:00Z-{u't': '1.0'},2015-01-28T21:50:00Z-{u't': '2.0'},2015-01-28T23:00:00-{u't': '3.0'},")
+            self.assertEqual (provider.lastTime, 1422486000000)
+        finally:
+            if localZone == None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = localZone
+            time.tzset()
+        
+    def test_fieldTypes (self):
+        """ Only numeric fields are stored as numbers """
+        provider = SOSProvider ()
+        provider.setObservation ("foi", 0, "code", "001", QVariant.String)
+        provider.setObservation ("foi", 0, "t", "1.50", QVariant.Double)
+        provider.setObservation ("foi", 1000, "code", "A1", QVariant.String)
+        provider.setObservation ("foi", 1000, "t", "-", QVariant.Double)
+        self.assertEqual ([provider._value("code", row) for row in range(2)], ["001", "A1"])
+        self.assertEqual ([provider._value("t", row) for row in range(2)], [1.5, None])
+        
+    def test_unknownTimes (self):
+        """ Observations without time come first and aren't later than any time """
+        provider = SOSProvider ()
+        provider.fields.append (QgsField ("Time", QVariant.String))
+        provider.features ["foi"] = ("name", None)
+        provider.setObservation ("foi", 2000, "t", "2", QVariant.Double)
+        provider.setObservation ("foi", None, "t", "0", QVariant.Double)
+        provider.setObservation ("foi", 1000, "t", "1", QVariant.Double)
+        provider.fields.append (QgsField ("t", QVariant.Double))
+        self.assertEqual ([f.attribute("t") for f in provider.getFeatures()], [0.0, 1.0, 2.0])
+        self.assertEqual ([f.attribute("Time") for f in provider.getFeatures()][0], "")
+        self.assertEqual ([f.attribute("t") for f in provider.getFeatures(1000)], [2.0])
+        self.assertEqual (provider.lastTime, 2000)
+        
+    getObservation = """<?xml version="1.0" encoding="UTF-8"?>
+<GetObservation xmlns="http://www.opengis.net/sos/1.0" xmlns:ogc="http://www.opengis.net/ogc" xmlns:gml="http://www.opengis.net/gml" xmlns:om="http://www.opengis.net/om/1.0" service="SOS" version="1.0.0">
+    <offering>ctd</offering>
+    <eventTime>
+        <ogc:TM_During>
+            <ogc:PropertyName>om:samplingTime</ogc:PropertyName>
+            <gml:TimePeriod>
+                <gml:beginPosition>2015-01-01T00:00:00Z</gml:beginPosition>
+                <gml:endPosition>2015-02-01T00:00:00Z</gml:endPosition>
+            </gml:TimePeriod>
+        </ogc:TM_During>
+    </eventTime>
+    <observedProperty>Temperatura</observedProperty>
+    <responseFormat>text/xml;subtype="om/1.0.0"</responseFormat>
+</GetObservation>"""
+    
+    def test_refresh (self):
+        xmlFile = self.observationFiles ['observationsIntecmar.xml']
+        layer = ObservationsLayer ('observationsIntecmar.xml', xmlFile, storage = ObservationsLayer.Memory)
+        layer.requestUrl = "http://sos.example.com/sos"
+        layer.requests = [self.getObservation] * 2
+        layer.toVectorLayer()
+        vectorLayer = layer.vectorLayer
+        lastTime = layer.provider.lastTime
+        count = vectorLayer.featureCount()
+        self.assertTrue (ObservationsLayer.appendable (vectorLayer))
+        
+        #Sin TM_After se repiten las peticiones
+        self.assertEqual (ObservationsLayer.refreshRequests (vectorLayer), ("http://sos.example.com/sos", layer.requests, lastTime))
+        
+        layer.afterFilter = True
+        layer.toVectorLayer()
+        vectorLayer = layer.vectorLayer
+        url, requests, after = ObservationsLayer.refreshRequests (vectorLayer)
+        self.assertEqual (url, "http://sos.example.com/sos")
+        self.assertEqual (after, lastTime)
+        self.assertEqual (len(requests), 1)
+        self.assertIn ("TM_After", requests[0])
+        self.assertEqual (requests[0].count("eventTime>"), 2)
+        self.assertNotIn ("TM_During", requests[0])
+        self.assertLess (requests[0].index("</offering>"), requests[0].index("<eventTime>"))
+        self.assertIn (QDateTime.fromMSecsSinceEpoch(lastTime).toUTC().toString("yyyy-MM-dd'T'hh:mm:ss"), requests[0])
+        self.assertEqual (ObservationsLayer.refreshRequests (QgsVectorLayer("Point", "empty", "memory")), ("", [], None))
+        self.assertFalse (ObservationsLayer.appendable (QgsVectorLayer("Point", "empty", "memory")))
+        
+        newer = ObservationsLayer ('observationsIntecmar.xml', xmlFile)
+        self.assertEqual (newer.appendTo (vectorLayer, after), 0)
+        newer = ObservationsLayer ('observationsIntecmar.xml', xmlFile)
+        self.assertEqual (newer.appendTo (vectorLayer), count)
+        self.assertEqual (vectorLayer.featureCount(), 2 * count)
+        
 if __name__ == "__main__":
     suite = unittest.makeSuite(ObservationsLayerTest)
     runner = unittest.TextTestRunner(verbosity=2)
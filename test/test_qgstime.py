@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from sos.qgstime import QgsTime, QgsTimePeriod
+from datetime import datetime, timedelta
+from dateutil import parser as DateTimeParser
+import cPickle
+from sos.qgstime import QgsTime, QgsTimePeriod, QgsTimeInstant, parseIsoDateTime, parseEpochMSecs, parseTimeKey
 from sos.xmlparser import XMLParserFactory
 
 
@@ -43,6 +46,60 @@ class QgsTimeTest(unittest.TestCase):
             
         self.assertEqual(str(timeParser.parse(xml)), '2015-03-17T17:29:00')
         
+    def test_isoDateTime (self):
+        """ISO 8601 fast path"""
+        
+        for text in ["2015-03-17T17:29:00.000", "2014-10-01T12:30:00Z", "2015-01-28T20:40:00.123456789+01:00",
+                     "2015-01-28T20:40:00-0330", "2015-01-28T20:40+00:00", "2015-01-28 20:40", "2015-01-28"]:
+            self.assertEqual (parseIsoDateTime(text), DateTimeParser.parse(text), text)
+            self.assertEqual (str(parseIsoDateTime(text).tzinfo), str(DateTimeParser.parse(text).tzinfo), text)
+        self.assertEqual (parseIsoDateTime("2015-01-28T20:40:00Z").utcoffset(), timedelta(0))
+        self.assertEqual (parseIsoDateTime("2015-01-28T20:40:00.5"), datetime(2015, 1, 28, 20, 40, 0, 500000))
+        self.assertEqual (parseIsoDateTime("2015-01-28T20:40:00,5"), datetime(2015, 1, 28, 20, 40, 0, 500000))
+        for text in ["28/01/2015", "2015-02-30T00:00:00", "latest", "2015-01-28T20:40:00 GMT"]:
+            self.assertIsNone (parseIsoDateTime(text), text)
+        self.assertEqual (str(QgsTimePeriod("28 Jan 2015 20:40", "2015-01-28T20:50:00")), "2015-01-28T20:40:00 2015-01-28T20:50:00")
+        
+    def test_epochMSecs (self):
+        """Epoch milliseconds"""
+        
+        self.assertEqual (parseEpochMSecs("1970-01-01T00:00:01Z"), 1000)
+        self.assertEqual (parseEpochMSecs("1970-01-01T00:00:01.250"), 1250)
+        self.assertEqual (parseEpochMSecs("1970-01-01T01:00:00+01:00"), 0)
+        self.assertEqual (parseEpochMSecs("2015-01-28T20:40:00Z"), 1422477600000)
+        self.assertIsNone (parseEpochMSecs("latest"))
+        self.assertEqual (parseTimeKey("1970-01-01T01:00:00+01:00"), (0, True))
+        self.assertEqual (parseTimeKey("1970-01-01T00:00:01"), (1000, False))
+        
+    def test_values (self):
+        """Immutable time values"""
+        
+        period = QgsTimePeriod("2015-01-28T20:40:00Z", "2015-01-28T22:40:00+01:00")
+        self.assertEqual ((period.begin, period.end), (1422477600000, 1422477600000 + 3600000))
+        self.assertEqual (period, QgsTimePeriod("2015-01-28T21:40:00+01:00", "2015-01-28T21:40:00"))
+        self.assertEqual (hash(period), hash(QgsTimePeriod("2015-01-28T20:40:00", "2015-01-28T21:40:00Z")))
+        self.assertNotEqual (period, QgsTimeInstant("2015-01-28T20:40:00Z"))
+        self.assertLess (QgsTimeInstant("2015-01-28T20:40:00Z"), QgsTimeInstant("2015-01-28T20:41:00Z"))
+        self.assertLess (QgsTimeInstant("first"), QgsTimeInstant("2015-01-28T20:41:00Z"))
+        with self.assertRaises(AttributeError):
+            period._values = ()
+        
+        self.assertTrue (period.contains(QgsTimeInstant("2015-01-28T21:00:00Z")))
+        self.assertTrue (period.contains(1422477600000))
+        self.assertFalse (period.contains(QgsTimePeriod("2015-01-28T21:00:00Z", "latest")))
+        self.assertTrue (period.overlaps(QgsTimePeriod("2015-01-28T21:00:00Z", "latest")))
+        self.assertTrue (period.overlaps(QgsTimePeriod("first", "2015-01-28T20:40:00Z")))
+        self.assertFalse (period.overlaps(QgsTimeInstant("2015-01-28T21:40:00.001Z")))
+        self.assertTrue (QgsTimePeriod("first", "latest").contains(period))
+        
+        unknown = QgsTimeInstant("not a time")
+        self.assertEqual ((unknown.date, unknown.begin, str(unknown)), (None, None, ""))
+        self.assertFalse (period.overlaps(unknown))
+        
+        for time in [period, QgsTimeInstant("latest"), unknown, QgsTime()]:
+            copy = cPickle.loads(cPickle.dumps(time, cPickle.HIGHEST_PROTOCOL))
+            self.assertEqual ((type(copy), copy, str(copy)), (type(time), time, str(time)))
+        
 if __name__ == "__main__":
     suite = unittest.makeSuite(QgsTimeTest)
     runner = unittest.TextTestRunner(verbosity=2)
@@ -1,6 +1,12 @@
 # coding=utf-8
 import unittest
+import os
+import shutil
+import tempfile
+from datetime import timedelta
 from qgis.core import QgsRectangle
+from PyQt4.QtCore import QFile
+from PyQt4.QtXml import QDomNode
 from sos.qgstime import QgsTime
 from sos.sos import * #@UnusedWildImport
 
@@ -81,6 +87,103 @@ class SensorObservationServiceTest(unittest.TestCase):
         self.assertIn("TM_After", self.service.temporalOperators)
         self.assertIn("EqualTo", self.service.scalarOperators)
         
+    def test_temporalWindows (self):
+        """ Time period filter split """
+        filters = FilterRequest (self.service)
+        filters.temporalFilter = True
+        filters.temporalOperator = "TM_During"
+        filters.temporalOperand = "gml:TimePeriod"
+        filters.temporalValue = "2015-01-01T00:00:00Z 2015-01-10T12:00:00Z"
+        windows = filters.temporalWindows(timedelta(days = 3))
+        self.assertEqual (len(windows), 4)
+        self.assertEqual (str(windows[0].temporalValue), "2015-01-01T00:00:00+00:00 2015-01-04T00:00:00+00:00")
+        self.assertEqual (str(windows[1].temporalValue).split()[0], "2015-01-04T00:00:00+00:00")
+        self.assertEqual (str(windows[-1].temporalValue).split()[-1], "2015-01-10T12:00:00+00:00")
+        self.assertEqual (str(filters.temporalValue), "2015-01-01T00:00:00+00:00 2015-01-10T12:00:00+00:00")
+        
+        #Extremos con y sin zona, sin zona se toma como UTC
+        filters.temporalValue = "2015-01-01T00:00:00 2015-01-10T13:00:00+01:00"
+        windows = filters.temporalWindows(timedelta(days = 3))
+        self.assertEqual (len(windows), 4)
+        self.assertEqual (str(windows[0].temporalValue), "2015-01-01T00:00:00+00:00 2015-01-04T00:00:00+00:00")
+        self.assertEqual (str(windows[-1].temporalValue).split()[-1], "2015-01-10T12:00:00+00:00")
+        
+        filters.temporalOperator = "TM_After"
+        self.assertEqual (filters.temporalWindows(timedelta(days = 3)), [filters])
+        
+    def test_spatialTiles (self):
+        """ Envelope split in tiles """
+        filters = FilterRequest (self.service)
+        extent = QgsRectangle (0, 0, 4, 2)
+        tiles = filters.spatialTiles(2, extent = extent)
+        self.assertEqual (len(tiles), 4)
+        self.assertEqual (tiles[0]._spatialValue, QgsRectangle (0, 0, 2, 1))
+        self.assertEqual (tiles[-1]._spatialValue, QgsRectangle (2, 1, 4, 2))
+        for tile in tiles:
+            self.assertTrue (tile.spatialFilter)
+            self.assertEqual (tile.spatialOperator, "BBOX")
+            self.assertEqual (tile.spatialOperand, "gml:Envelope")
+        self.assertFalse (filters.spatialFilter)
+        self.assertEqual (filters.spatialTiles(1, extent = extent), [filters])
+        
+        filters.spatialFilter = True
+        filters.spatialOperand = "gml:Point"
+        self.assertEqual (filters.spatialTiles(2, extent = extent), [filters])
+        
+        filters.spatialOperand = "gml:Envelope"
+        filters._spatialValue = extent
+        for operator in ["BBOX", "Intersects"]:
+            filters.spatialOperator = operator
+            self.assertEqual ([tile.spatialOperator for tile in filters.spatialTiles(2)], [operator] * 4)
+        for operator in ["Contains", "Overlaps", "Disjoint", "Within", "Equals"]:
+            filters.spatialOperator = operator
+            self.assertEqual (filters.spatialTiles(2), [filters])
+        
+    def test_lazyOfferings (self):
+        """ Offerings parsed on first access """
+        service = SensorObservationService ("test/capabilities52N.xml", "test/capabilities52N.xml")
+        offerings = service._capabilities.observationOfferingList
+        self.assertTrue (all(isinstance(o, QDomNode) for o in offerings._offerings.values()))
+        offer = service.observationOfferingList[0]
+        self.assertIsInstance (service[offer], SOSObservationOffering)
+        self.assertIs (service[offer], service[offer])
+        self.assertEqual (len([o for o in offerings._offerings.values() if isinstance(o, QDomNode)]), len(offerings) - 1)
+        
+    def test_snapshot (self):
+        """ Parsed capabilities snapshot """
+        tempDir = tempfile.mkdtemp()
+        try:
+            xmlFile = os.path.join(tempDir, "capabilities.xml")
+            snapshotFile = os.path.join(tempDir, "capabilities.snapshot")
+            shutil.copyfile("test/capabilities52N.xml", xmlFile)
+            for _ in range(2):
+                service = SensorObservationService ("test/capabilities52N.xml", xmlFile, snapshotFile)
+                self.assertTrue (os.path.exists(snapshotFile))
+                #Offerings are still parsed on first access
+                offerings = service._capabilities.observationOfferingList._offerings.values()
+                self.assertFalse (any(isinstance(o, SOSObservationOffering) for o in offerings))
+                self.assertEqual (unicode(service), unicode(self.service))
+                self.assertEqual (sorted(service.observationOfferingList), sorted(self.service.observationOfferingList))
+                self.assertEqual (service.operationsMetadata.keys(), self.service.operationsMetadata.keys())
+                self.assertEqual (service.temporalOperators, self.service.temporalOperators)
+                for offering in service.observationOfferingList:
+                    self.assertEqual (service[offering].observedArea, self.service[offering].observedArea)
+                    self.assertEqual (str(service[offering].phenomenonTime), str(self.service[offering].phenomenonTime))
+                self.assertIsInstance (service.capabilitiesXml, QFile)
+                self.assertEqual (service.capabilitiesXml.fileName(), xmlFile)
+            
+            #Snapshot can't be written, capabilities are parsed anyway
+            service = SensorObservationService ("test/capabilities52N.xml", xmlFile, os.path.join(tempDir, "missing", "capabilities.snapshot"))
+            self.assertEqual (unicode(service), unicode(self.service))
+            
+            #XML changed, snapshot is discarded
+            with open (xmlFile, "w") as xml:
+                xml.write (open("test/exceptionreport.xml").read())
+            with self.assertRaises(ExceptionReport):
+                SensorObservationService ("test/capabilities52N.xml", xmlFile, snapshotFile)
+        finally:
+            shutil.rmtree (tempDir)
+        
 if __name__ == "__main__":
     suite = unittest.makeSuite(SensorObservationServiceTest)
     runner = unittest.TextTestRunner(verbosity=2)
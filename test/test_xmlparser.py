@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from sos.xmlparser import XMLParser
+from sos.xmlparser import XMLParser, XMLQuery
 
 
 class XMLParserTest(unittest.TestCase):
@@ -79,3 +79,19 @@ class XMLParserTest(unittest.TestCase):
             for (_, v2) in self.parser.search(n, 'subnode'):
                 lista.append(v2)
         self.assertEqual(lista, ['S2.1', 'S2.2'])
+
+    def test_search_compiled_query(self):
+        """Test buscar con consulta compilada"""
+
+        query = XMLQuery('subnodes@ref=2')
+        self.assertEqual((query.path, query.attribute, query.value),
+                         (['subnodes'], 'ref', '2'))
+        self.assertEqual([v for (_, v) in self.parser.search(self.xml, query)],
+                         [v for (_, v) in self.parser.search(self.xml, 'subnodes@ref=2')])
+
+    def test_query_cache(self):
+        """Test cache de consultas compiladas"""
+
+        self.assertIs(XMLQuery.compile('node@id'), XMLQuery.compile('node@id'))
+        with self.assertRaises(TypeError):
+            XMLQuery.compile(u'node@id')
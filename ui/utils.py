@@ -19,7 +19,10 @@ from matplotlib.figure import Figure
 from matplotlib import dates as mpdates
 from matplotlib import rcParams, rcdefaults
 from matplotlib.cm import get_cmap
+from sos.qgstime import parseEpochMSecs
+from datetime import datetime
 from random import randint
+import numpy
 
 class QDirChooser (QtGui.QLineEdit):
     def __init__(self,parent=None, dirName = QtCore.QDir.tempPath()):
@@ -116,6 +119,22 @@ class QMplWidget (QtGui.QWidget):
             self.ax.yaxis.set_major_formatter(timeFormatter)
         self.figure.autofmt_xdate()
     
+    @staticmethod
+    def dateNums (values):
+        """
+        Matplotlib dates of times as epoch milliseconds or texts. Each distinct
+        text is parsed once, and all times are converted to dates at once
+        :param values: Times, epoch milliseconds or date and time texts
+        :type values: list
+        :return: Matplotlib dates, NaN if value isn't a time
+        :rtype: numpy.ndarray
+        """
+        epochs = {}
+        for value in set(values):
+            epochs[value] = value if isinstance(value, (int, long, float)) else parseEpochMSecs(value) if isinstance(value, basestring) else None
+        msecs = numpy.array([epochs[v] for v in values], dtype = float)
+        return msecs / 86400000. + mpdates.date2num(datetime(1970, 1, 1))
+    
     def plot(self, x=[], y=[], label = None):
         def _float(value):
             try:
@@ -124,11 +143,11 @@ class QMplWidget (QtGui.QWidget):
                 return -9999
             
         if self.xdate:
-            x = [mpdates.datestr2num(v) for v in x]
+            x = self.dateNums(x)
         else:
             x = [_float(v) for v in x]
         if self.ydate:
-            y = [mpdates.datestr2num(v) for v in y]
+            y = self.dateNums(y)
         else:
             y = [_float(v) for v in y]
         
@@ -159,8 +159,8 @@ class TimeWidget (QtGui.QWidget, WidgetFactory.getClass("time_widget")):
             self.rbLatest.setChecked (True)
         else:
             self.rbCustom.setChecked (True)
-            self.dateEdit.setDate (self.value.date)
-            self.timeEdit.setTime (self.value.time)
+            self.dateEdit.setDate (self.value.date or QtCore.QDate.currentDate())
+            self.timeEdit.setTime (self.value.time or QtCore.QTime(0, 0))
             
     
     def _changeValue (self):
@@ -208,15 +208,15 @@ class TimePeriodWidget (QtGui.QWidget, WidgetFactory.getClass("timeperiod_widget
             self.rbFirstBegin.setChecked (True)
         else:
             self.rbCustomBegin.setChecked (True)
-            self.dateEditBegin.setDate (self.value.beginDate)
-            self.timeEditBegin.setTime (self.value.beginTime)
+            self.dateEditBegin.setDate (self.value.beginDate or QtCore.QDate.currentDate())
+            self.timeEditBegin.setTime (self.value.beginTime or QtCore.QTime(0, 0))
             
         if self.value.endDate == 'latest':
             self.rbLatestEnd.setChecked (True)
         else:
             self.rbCustomEnd.setChecked (True)
-            self.dateEditEnd.setDate (self.value.endDate)
-            self.timeEditEnd.setTime (self.value.endTime)
+            self.dateEditEnd.setDate (self.value.endDate or QtCore.QDate.currentDate())
+            self.timeEditEnd.setTime (self.value.endTime or QtCore.QTime(0, 0))
             
     def _changeValue (self):
         if self.rbFirstBegin.isChecked():